@@ -1,7 +1,7 @@
 from PIL import Image, ImageDraw
 import heapq
 import random
-import imageio.v2 as imageio
+import time
 
 # Grid and Cell Size
 WIDTH, HEIGHT = 100, 100
@@ -26,15 +26,11 @@ def heuristic(a, b):
     return abs(a[0] - b[0]) + abs(a[1] - b[1])
 
 # Draw frame
-def draw_frame(grid, open_set, closed_set, path, current, frame_list):
-    img = Image.new("RGB", (len(grid[0]) * CELL_SIZE, len(grid) * CELL_SIZE), "white")
+def draw_frame(grid, open_set, closed_set, path, current, frame_list, background=None):
+    # background is a pre-drawn image of the walls, reused instead of redrawing every cell
+    img = background.copy() if background is not None else draw_background(grid)
     draw = ImageDraw.Draw(img)
 
-    for y in range(len(grid)):
-        for x in range(len(grid[0])):
-            color = "black" if grid[y][x] == 0 else "white"
-            draw.rectangle([x*CELL_SIZE, y*CELL_SIZE, (x+1)*CELL_SIZE, (y+1)*CELL_SIZE], fill=color)
-
     for (x, y) in closed_set:
         draw.rectangle([x*CELL_SIZE, y*CELL_SIZE, (x+1)*CELL_SIZE, (y+1)*CELL_SIZE], fill="lightgray")
 
@@ -51,8 +47,35 @@ def draw_frame(grid, open_set, closed_set, path, current, frame_list):
 
     frame_list.append(img)
 
-# A* with frame generation
-def a_star(grid, start, goal):
+# Walls only
+def draw_background(grid):
+    img = Image.new("RGB", (len(grid[0]) * CELL_SIZE, len(grid) * CELL_SIZE), "white")
+    draw = ImageDraw.Draw(img)
+
+    for y in range(len(grid)):
+        for x in range(len(grid[0])):
+            color = "black" if grid[y][x] == 0 else "white"
+            draw.rectangle([x*CELL_SIZE, y*CELL_SIZE, (x+1)*CELL_SIZE, (y+1)*CELL_SIZE], fill=color)
+
+    return img
+
+# Walk parent links back to the start
+def reconstruct_path(came_from, start, current):
+    path = []
+    while current in came_from:
+        path.append(current)
+        current = came_from[current]
+    path.append(start)
+    path.reverse()
+    return path
+
+# Headless A*: returns the path (None if unreachable) and search stats.
+# trace, if given, is called as trace(event, node, data) with events
+# "open" (node reached, data = its parent), "close" (node expanded, after
+# its neighbors were opened; not sent for the goal) and
+# "done" (node = None, data = the path); see FrameRecorder.
+def a_star(grid, start, goal, trace=None):
+    began = time.perf_counter()
     width, height = len(grid[0]), len(grid)
     open_heap = []
     heapq.heappush(open_heap, (0, start))
@@ -61,23 +84,20 @@ def a_star(grid, start, goal):
     f_score = {start: heuristic(start, goal)}
     open_set = {start}
     closed_set = set()
-    frames = []
+    stats = {"expanded": 0, "pushed": 1, "max_open": 1}
+    path = None
+    if trace:
+        trace("open", start, None)
 
     while open_heap:
         _, current = heapq.heappop(open_heap)
         open_set.discard(current)
         closed_set.add(current)
+        stats["expanded"] += 1
 
         if current == goal:
-            path = []
-            while current in came_from:
-                path.append(current)
-                current = came_from[current]
-            path.append(start)
-            path = path[::-1]
-            for _ in range(10):  # hold on final frame
-                draw_frame(grid, open_set, closed_set, path, None, frames)
-            return path, frames
+            path = reconstruct_path(came_from, start, current)
+            break
 
         for neighbor in get_neighbors(current, width, height):
             if grid[neighbor[1]][neighbor[0]] == 0 or neighbor in closed_set:
@@ -88,27 +108,73 @@ def a_star(grid, start, goal):
                 came_from[neighbor] = current
                 g_score[neighbor] = tentative_g
                 f_score[neighbor] = tentative_g + heuristic(neighbor, goal)
+                if trace:
+                    trace("open", neighbor, current)
                 if neighbor not in open_set:
                     heapq.heappush(open_heap, (f_score[neighbor], neighbor))
                     open_set.add(neighbor)
+                    stats["pushed"] += 1
+        stats["max_open"] = max(stats["max_open"], len(open_heap))
+        if trace:
+            trace("close", current, None)
+
+    stats["path_length"] = len(path) - 1 if path else None
+    stats["seconds"] = time.perf_counter() - began
+    if trace:
+        trace("done", None, path)
+    return path, stats
+
+# Renders an a_star event trace, drawing a frame every `every` expansions.
+# Frames go to sink (e.g. a video writer's append), or to self.frames.
+class FrameRecorder:
+    def __init__(self, grid, start, every=1, sink=None, hold=10):
+        self.grid = grid
+        self.start = start
+        self.every = every
+        self.hold = hold  # Copies of the final frame
+        self.frames = []
+        self.sink = sink
+        self.background = draw_background(grid)
+        self.open_set = set()
+        self.closed_set = set()
+        self.came_from = {}
+        self.expanded = 0
+
+    def emit(self, path, current):
+        frames = []
+        draw_frame(self.grid, self.open_set, self.closed_set, path, current, frames, self.background)
+        if self.sink is None:
+            self.frames.extend(frames)
+        else:
+            self.sink(frames[0])
+
+    def __call__(self, event, node, data):
+        if event == "open":
+            self.open_set.add(node)
+            if data is not None:
+                self.came_from[node] = data
+        elif event == "close":
+            self.open_set.discard(node)
+            self.closed_set.add(node)
+            self.expanded += 1
+            if self.expanded % self.every == 0:
+                self.emit(reconstruct_path(self.came_from, self.start, node), node)
+        elif event == "done" and data:
+            for _ in range(self.hold):  # hold on final frame
+                self.emit(data, None)
 
-        path = []
-        trace = current
-        while trace in came_from:
-            path.append(trace)
-            trace = came_from[trace]
-        path.append(start)
-        path.reverse()
-
-        draw_frame(grid, open_set, closed_set, path, current, frames)
+# Main
+if __name__ == "__main__":
+    import imageio.v2 as imageio
+    import numpy as np
 
-    return None, frames
+    maze = generate_maze(WIDTH, HEIGHT)
+    start, goal = (1, 1), (WIDTH - 2, HEIGHT - 2)
 
-# Main
-maze = generate_maze(WIDTH, HEIGHT)
-start, goal = (1, 1), (WIDTH - 2, HEIGHT - 2)
-path, frames = a_star(maze, start, goal)
+    # Frames are streamed into the video as they are drawn instead of kept in memory
+    with imageio.get_writer(VIDEO_PATH, fps=30) as writer:
+        recorder = FrameRecorder(maze, start, every=1, sink=lambda img: writer.append_data(np.asarray(img)))
+        path, stats = a_star(maze, start, goal, trace=recorder)
 
-# Save video
-imageio.mimsave(VIDEO_PATH, frames, fps=30)
-print(f"{'Path found!' if path else 'No path found.'} Video saved as {VIDEO_PATH}")
+    print(f"{'Path found!' if path else 'No path found.'} Video saved as {VIDEO_PATH}")
+    print(f"Expanded {stats['expanded']} cells in {stats['seconds'] * 1000:.1f} ms")
@@ -0,0 +1,122 @@
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from GridAStar import OccupancyGrid, a_star_grid
+
+# Queries handed to a worker at a time; larger chunks mean fewer round trips
+CHUNK_SIZE = 16
+
+# The worker's view of the shared grid, set up once per process by _attach_worker
+_worker_shared = None
+_worker_grid = None
+
+def _attach_worker(name, width, height):
+    global _worker_shared, _worker_grid
+    _worker_shared = shared_memory.SharedMemory(name=name)
+    _worker_grid = OccupancyGrid.from_buffer(_worker_shared.buf, width, height)
+
+def _solve(pairs):
+    results = []
+    for start, goal in pairs:
+        results.append(_query(_worker_grid, start, goal))
+    return results
+
+# One query with a_star_grid; walls or out-of-map endpoints give no path instead of an error
+def _query(grid, start, goal):
+    if not (_inside(grid, start) and _inside(grid, goal) and grid.is_free(start) and grid.is_free(goal)):
+        path, stats = None, {"expanded": 0, "pushed": 0, "max_open": 0, "path_length": None, "seconds": 0.0}
+    else:
+        path, stats = a_star_grid(grid, start, goal)
+    stats["worker"] = os.getpid()
+    return path, stats
+
+def _inside(grid, pos):
+    return 0 <= pos[0] < grid.width and 0 <= pos[1] < grid.height
+
+# Pool of worker processes answering (start, goal) queries on one map. The map is
+# copied once into shared memory, which every worker maps instead of receiving a
+# pickled copy; only the queries and the paths travel between processes.
+# set_cell writes the shared map, so later batches see the change. Use as a
+# context manager, or call close.
+class PathQueryPool:
+    def __init__(self, grid, workers=None):
+        if not isinstance(grid, OccupancyGrid):
+            grid = OccupancyGrid.from_lists(grid)
+        self.workers = workers or os.cpu_count()
+        self._shared = shared_memory.SharedMemory(create=True, size=grid.size)
+        # The segment may be rounded up to a page; the grid only sees its first grid.size bytes
+        self._cells = self._shared.buf[:grid.size]
+        self._cells[:] = grid.cells
+        self.grid = OccupancyGrid.from_buffer(self._cells, grid.width, grid.height)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_attach_worker,
+            initargs=(self._shared.name, grid.width, grid.height),
+        )
+
+    # (path, stats) of every pair, in input order; stats as a_star_grid's plus the worker's pid
+    def find_paths(self, pairs, chunk_size=CHUNK_SIZE):
+        pairs = list(pairs)
+        chunks = [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+        results = []
+        for chunk in self._executor.map(_solve, chunks):
+            results.extend(chunk)
+        return results
+
+    def set_cell(self, pos, free):
+        self.grid.set_cell(pos, free)
+
+    def close(self):
+        if self._executor is None:
+            return
+        self._executor.shutdown()
+        self._executor = None
+        self.grid = None
+        self._cells.release()
+        self._shared.close()
+        self._shared.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Answer a batch of (start, goal) queries on one map across worker processes;
+# returns (path, stats) per pair in input order. workers=1 runs in this process.
+def find_paths(grid, pairs, workers=None, chunk_size=CHUNK_SIZE):
+    if not isinstance(grid, OccupancyGrid):
+        grid = OccupancyGrid.from_lists(grid)
+    if workers == 1:
+        return [_query(grid, start, goal) for start, goal in pairs]
+    with PathQueryPool(grid, workers) as pool:
+        return pool.find_paths(pairs, chunk_size)
+
+# Benchmark: a batch of random queries, sequential a_star and a_star_grid loops against the pool
+if __name__ == "__main__":
+    from AStarPathfinding import a_star, generate_maze
+
+    random.seed(0)
+    size, count = 300, 200
+    maze = generate_maze(size, size, obstacle_chance=0.2)
+    free = [(x, y) for y in range(size) for x in range(size) if maze[y][x]]
+    pairs = [(random.choice(free), random.choice(free)) for _ in range(count)]
+    print(f"{size}x{size}, {count} queries, {os.cpu_count()} CPUs")
+
+    began = time.perf_counter()
+    reference = [a_star(maze, start, goal)[0] for start, goal in pairs]
+    print(f"  a_star loop:      {count / (time.perf_counter() - began):7.1f} queries/s")
+
+    began = time.perf_counter()
+    find_paths(maze, pairs, workers=1)
+    print(f"  a_star_grid loop: {count / (time.perf_counter() - began):7.1f} queries/s")
+
+    for workers in sorted({2, 4, os.cpu_count()} - {1}):
+        began = time.perf_counter()
+        results = find_paths(maze, pairs, workers=workers)
+        rate = count / (time.perf_counter() - began)
+        same = all(path == other for (path, _), other in zip(results, reference))
+        used = len({stats["worker"] for _, stats in results})
+        print(f"  {workers} workers:        {rate:7.1f} queries/s (pool start included), {used} used, same paths: {same}")
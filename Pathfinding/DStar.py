@@ -1,5 +1,7 @@
 from PIL import Image, ImageDraw
 import heapq
+import random
+import time
 
 # Grid size
 GRID_WIDTH, GRID_HEIGHT = 20, 20
@@ -70,6 +72,8 @@ class PriorityQueue:
     def empty(self):
         return not self.elements
 
+INF = float("inf")
+
 # Basic D* path planning (reverse A* logic)
 def d_star(grid, start, goal):
     open_list = PriorityQueue()
@@ -78,6 +82,8 @@ def d_star(grid, start, goal):
     g = {goal: 0}
     back_pointer = {}
 
+    width, height = len(grid[0]), len(grid)
+
     while not open_list.empty():
         current = open_list.pop()
 
@@ -86,7 +92,7 @@ def d_star(grid, start, goal):
 
         for dx, dy in DIRS:
             nx, ny = current[0] + dx, current[1] + dy
-            if 0 <= nx < GRID_WIDTH and 0 <= ny < GRID_HEIGHT:
+            if 0 <= nx < width and 0 <= ny < height:
                 if grid[ny][nx] == OBSTACLE:
                     continue
 
@@ -108,6 +114,192 @@ def d_star(grid, start, goal):
     path.append(goal)
     return path
 
+# D* Lite (Koenig and Likhachev): a search from the goal whose g and rhs
+# tables persist between plans. g is the settled goal distance of a cell,
+# rhs the one-step lookahead from its neighbors' g; cells where the two
+# differ are queued. When cells change, only the cells whose distances
+# actually change are re-expanded, and the key modifier km keeps old queue
+# keys valid as the robot (the start) moves, so nothing is re-sorted.
+class DStarLite:
+    def __init__(self, grid, start, goal):
+        self.grid = grid  # Updated in place by update_cells
+        self.width, self.height = len(grid[0]), len(grid)
+        self.start = start
+        self.goal = goal
+        self.last = start  # Start position at the last km update
+        self.km = 0
+        self.g = {}
+        self.rhs = {goal: 0}
+        self.queue = []  # (k1, k2, cell); stale entries are skipped on pop
+        self.keys = {goal: self.calculate_key(goal)}  # Current key of every queued cell
+        heapq.heappush(self.queue, (*self.keys[goal], goal))
+        self.expanded = 0
+
+    def calculate_key(self, cell):
+        best = min(self.g.get(cell, INF), self.rhs.get(cell, INF))
+        return best + heuristic(self.start, cell) + self.km, best
+
+    def neighbors(self, cell):
+        x, y = cell
+        for dx, dy in DIRS:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < self.width and 0 <= ny < self.height and self.grid[ny][nx] == FREE:
+                yield nx, ny
+
+    # One-step lookahead: 1 + the smallest g among the free neighbors
+    def lookahead(self, cell):
+        if cell == self.goal:
+            return 0
+        x, y = cell
+        if self.grid[y][x] == OBSTACLE:
+            return INF
+        g = self.g
+        best = INF
+        for n in self.neighbors(cell):
+            value = g.get(n, INF)
+            if value < best:
+                best = value
+        return best + 1
+
+    # Queue the cell with its current key if it is inconsistent (g != rhs), else drop it
+    def update_vertex(self, cell):
+        g, rhs = self.g.get(cell, INF), self.rhs.get(cell, INF)
+        if g != rhs:
+            best = min(g, rhs)
+            key = best + heuristic(self.start, cell) + self.km, best
+            if self.keys.get(cell) != key:
+                self.keys[cell] = key
+                heapq.heappush(self.queue, (*key, cell))
+        else:
+            self.keys.pop(cell, None)
+
+    # Key of the first live queue entry
+    def top_key(self):
+        queue = self.queue
+        while queue:
+            k1, k2, cell = queue[0]
+            if self.keys.get(cell) == (k1, k2):
+                return k1, k2
+            heapq.heappop(queue)
+        return INF, INF
+
+    def compute_shortest_path(self):
+        g, rhs, goal = self.g, self.rhs, self.goal
+        expanded = 0
+        while True:
+            top = self.top_key()
+            start = self.start
+            if top >= self.calculate_key(start) and rhs.get(start, INF) == g.get(start, INF):
+                break
+            k1, k2, cell = heapq.heappop(self.queue)
+            new_key = self.calculate_key(cell)
+            if top < new_key:
+                self.keys[cell] = new_key
+                heapq.heappush(self.queue, (*new_key, cell))
+                continue
+            del self.keys[cell]
+            expanded += 1
+            g_old = g.get(cell, INF)
+            if g_old > rhs[cell]:
+                # Distance went down: neighbors can only improve through this cell
+                g[cell] = rhs[cell]
+                cost = g[cell] + 1
+                for n in self.neighbors(cell):
+                    if n != goal and cost < rhs.get(n, INF):
+                        rhs[n] = cost
+                        self.update_vertex(n)
+            else:
+                # Distance went up: recompute the cells that relied on the old one
+                g[cell] = INF
+                for n in [*self.neighbors(cell), cell]:
+                    if n == cell or rhs.get(n, INF) == g_old + 1:
+                        rhs[n] = self.lookahead(n)
+                    self.update_vertex(n)
+        self.expanded += expanded
+        return expanded
+
+    # Greedy descent of g from the start; [] if the goal is unreachable
+    def path(self):
+        g = self.g
+        current = self.start
+        if g.get(current, INF) == INF:
+            return []
+        path = [current]
+        while current != self.goal:
+            current = min(self.neighbors(current), key=lambda n: g.get(n, INF))
+            path.append(current)
+        return path
+
+    # (path, stats) for the current start, repairing whatever is inconsistent
+    def plan(self):
+        began = time.perf_counter()
+        expanded = self.compute_shortest_path()
+        path = self.path()
+        stats = {"expanded": expanded, "path_length": len(path) - 1 if path else None}
+        stats["seconds"] = time.perf_counter() - began
+        return path, stats
+
+    def move(self, cell):
+        self.start = cell
+
+    # Apply ((x, y), FREE or OBSTACLE) changes and replan from the current start
+    def update_cells(self, changes):
+        self.km += heuristic(self.last, self.start)
+        self.last = self.start
+        for (x, y), value in changes:
+            if self.grid[y][x] == value:
+                continue
+            self.grid[y][x] = value
+            # The cell's own rhs and those of its neighbors may depend on it
+            for dx, dy in ((0, 0), *DIRS):
+                nx, ny = x + dx, y + dy
+                if 0 <= nx < self.width and 0 <= ny < self.height:
+                    self.rhs[nx, ny] = self.lookahead((nx, ny))
+                    self.update_vertex((nx, ny))
+        return self.plan()
+
+# Random map with FREE start and goal corners
+def random_grid(width, height, obstacle_chance=0.2):
+    grid = [[OBSTACLE if random.random() < obstacle_chance else FREE for _ in range(width)] for _ in range(height)]
+    grid[1][1] = grid[height - 2][width - 2] = FREE
+    return grid
+
+# Robot walks to the goal; every few steps a wall appears a few cells ahead on its path.
+# Compares D* Lite's repair with replanning from scratch with d_star.
+def benchmark(sizes=(GRID_WIDTH, 100, 300, 1000), obstacle_chance=0.2, every=10, max_replans=50, seed=0):
+    for size in sizes:
+        random.seed(seed)
+        grid = random_grid(size, size, obstacle_chance)
+        start, goal = (1, 1), (size - 2, size - 2)
+        planner = DStarLite([row[:] for row in grid], start, goal)
+        path, stats = planner.plan()
+        initial = stats["seconds"]
+        repair = scratch = 0.0
+        replans = steps = mismatches = 0
+        while len(path) > 1 and replans < max_replans:
+            planner.move(path[1])
+            path = path[1:]
+            steps += 1
+            ahead = min(6, len(path) - 2)  # Never the goal itself
+            if steps % every or ahead < 1:
+                continue
+            path, stats = planner.update_cells([(path[ahead], OBSTACLE)])
+            repair += stats["seconds"]
+            replans += 1
+
+            began = time.perf_counter()
+            reference = d_star(planner.grid, planner.start, goal)
+            scratch += time.perf_counter() - began
+            mismatches += len(reference) != len(path)
+        print(f"{size}x{size}: initial plan {initial * 1000:.0f} ms", end="")
+        if replans:
+            print(
+                f"; {replans} replans, D* Lite {repair / replans * 1000:.2f} ms vs d_star "
+                f"{scratch / replans * 1000:.1f} ms on average; length mismatches: {mismatches}"
+            )
+        else:
+            print()
+
 # Main
 def main():
     # Build map
@@ -121,4 +313,11 @@ def main():
     path = d_star(grid, start, goal)
     draw_grid(grid, path, start, goal)
 
-main()
+# python DStar.py draws the plan; python DStar.py --benchmark times replanning up to 1000x1000
+if __name__ == "__main__":
+    import sys
+
+    if "--benchmark" in sys.argv[1:]:
+        benchmark()
+    else:
+        main()
@@ -0,0 +1,180 @@
+import random
+import time
+from collections import OrderedDict
+import numpy as np
+from GridAStar import OccupancyGrid, index_dtype
+
+# Reverse breadth-first search from the goal, the idea of d_star run to
+# completion: every free cell gets its distance to the goal, one wave of the
+# frontier at a time with NumPy. Returns flat distances indexed by node id,
+# -1 for walls and cells that cannot reach the goal.
+def goal_distances(grid, goal):
+    cells = np.frombuffer(grid.cells, dtype=np.uint8)
+    distance = np.full(grid.size, -1, dtype=index_dtype(grid))
+    target = grid.node(goal)
+    if not cells[target]:
+        return distance
+    offsets = np.array(grid.offsets, dtype=distance.dtype)
+    distance[target] = 0
+    frontier = np.array([target], dtype=distance.dtype)
+    wave = 0
+    while frontier.size:
+        wave += 1
+        # The wall border keeps every neighbor id inside the array
+        candidates = (frontier[:, None] + offsets).ravel()
+        candidates = np.unique(candidates[(cells[candidates] != 0) & (distance[candidates] < 0)])
+        distance[candidates] = wave
+        frontier = candidates
+    return distance
+
+# Direction (index into grid.offsets) of the next step towards the goal for every node:
+# the first neighbor, in left, right, up, down order, one step closer. -1 at the goal,
+# on walls and on cells that cannot reach it.
+def next_steps(grid, distance):
+    steps = np.full(grid.size, -1, dtype=np.int8)
+    reached = distance > 0
+    neighbor = np.empty_like(distance)
+    for direction, offset in enumerate(grid.offsets):
+        neighbor.fill(-1)
+        if offset > 0:
+            neighbor[:-offset] = distance[offset:]
+        else:
+            neighbor[-offset:] = distance[:offset]
+        steps[reached & (steps < 0) & (neighbor == distance - 1)] = direction
+    return steps
+
+# Distances and next steps towards one goal for every cell of an OccupancyGrid
+# (or a 1 = free list grid), from a single search. Any number of agents then
+# read their shortest path in O(path length). The field is a snapshot: it does
+# not follow later changes to the grid (FlowFieldCache drops stale fields).
+class FlowField:
+    def __init__(self, grid, goal):
+        if not isinstance(grid, OccupancyGrid):
+            grid = OccupancyGrid.from_lists(grid)
+        began = time.perf_counter()
+        self.grid = grid
+        self.goal = goal
+        self._distance = goal_distances(grid, goal)
+        self._steps = next_steps(grid, self._distance)
+        self.seconds = time.perf_counter() - began
+
+    # (height, width) views, indexed [y, x] like the list grids
+    @property
+    def distance(self):
+        return self._grid_view(self._distance)
+
+    @property
+    def directions(self):
+        return self._grid_view(self._steps)
+
+    def _grid_view(self, flat):
+        grid = self.grid
+        return flat.reshape(grid.width + 2, grid.stride)[1:-1, 1:-1].T
+
+    def distance_from(self, pos):
+        distance = int(self._distance[self.grid.node(pos)])
+        return distance if distance >= 0 else None
+
+    def next_step(self, pos):
+        direction = self._steps[self.grid.node(pos)]
+        if direction < 0:
+            return None
+        return self.grid.pos(self.grid.node(pos) + self.grid.offsets[direction])
+
+    # Path from pos to the goal, or None if the goal cannot be reached
+    def path(self, pos):
+        grid = self.grid
+        node = grid.node(pos)
+        if self._distance[node] < 0:
+            return None
+        steps, offsets = memoryview(self._steps), grid.offsets
+        path = [pos]
+        direction = steps[node]
+        while direction >= 0:
+            node += offsets[direction]
+            path.append(grid.pos(node))
+            direction = steps[node]
+        return path
+
+    # Whether changing the cell at node can change this field: a new wall on a
+    # reached cell, or an opening next to one
+    def _affected_by(self, node):
+        distance = self._distance
+        if distance[node] >= 0:
+            return True
+        return any(distance[node + offset] >= 0 for offset in self.grid.offsets)
+
+# LRU cache of flow fields per goal over one grid. Cell changes go through
+# set_cell, which drops only the fields the change can affect.
+class FlowFieldCache:
+    def __init__(self, grid, max_fields=16):
+        if not isinstance(grid, OccupancyGrid):
+            grid = OccupancyGrid.from_lists(grid)
+        self.grid = grid
+        self.max_fields = max_fields
+        self._fields = OrderedDict()  # goal -> FlowField, oldest first
+        self.hits = self.misses = self.invalidations = 0
+
+    def get(self, goal):
+        field = self._fields.get(goal)
+        if field is not None:
+            self._fields.move_to_end(goal)
+            self.hits += 1
+            return field
+        self.misses += 1
+        field = FlowField(self.grid, goal)
+        self._fields[goal] = field
+        if len(self._fields) > self.max_fields:
+            self._fields.popitem(last=False)
+        return field
+
+    def path(self, start, goal):
+        return self.get(goal).path(start)
+
+    def set_cell(self, pos, free):
+        if self.grid.is_free(pos) == bool(free):
+            return
+        self.grid.set_cell(pos, free)
+        node = self.grid.node(pos)
+        for goal in [goal for goal, field in self._fields.items() if field._affected_by(node)]:
+            del self._fields[goal]
+            self.invalidations += 1
+
+    def clear(self):
+        self._fields.clear()
+
+    def __len__(self):
+        return len(self._fields)
+
+# Benchmark: many agents heading for one goal, a_star_grid per agent against one flow field
+if __name__ == "__main__":
+    from AStarPathfinding import generate_maze
+    from GridAStar import a_star_grid
+
+    random.seed(0)
+    for size, agents in ((100, 500), (512, 500), (1000, 200)):
+        maze = generate_maze(size, size, obstacle_chance=0.2)
+        grid = OccupancyGrid.from_lists(maze)
+        goal = (size - 2, size - 2)
+        free = [(x, y) for y in range(size) for x in range(size) if maze[y][x]]
+        starts = [random.choice(free) for _ in range(agents)]
+
+        began = time.perf_counter()
+        field = FlowField(grid, goal)
+        paths = [field.path(start) for start in starts]
+        field_seconds = time.perf_counter() - began
+
+        # a_star_grid on a sample of the agents, scaled up
+        sample = starts[:20]
+        began = time.perf_counter()
+        reference = [a_star_grid(grid, start, goal)[0] for start in sample]
+        astar_seconds = (time.perf_counter() - began) * agents / len(sample)
+
+        longer = sum(
+            len(path) > len(other) for path, other in zip(paths, reference) if path and other
+        )
+        print(
+            f"{size}x{size}, {agents} agents: flow field {field.seconds * 1000:.0f} ms + paths "
+            f"{(field_seconds - field.seconds) * 1000:.0f} ms; a_star_grid per agent ~{astar_seconds:.1f} s; "
+            f"paths longer than A*'s: {longer}"
+        )
@@ -0,0 +1,152 @@
+import heapq
+import random
+import time
+import numpy as np
+
+# Node states
+UNSEEN, OPEN, CLOSED = 0, 1, 2
+
+# Occupancy grid with flat integer node ids (1 = free, 0 = wall, as in AStarPathfinding)
+class OccupancyGrid:
+    def __init__(self, free):
+        free = np.asarray(free) != 0
+        height, width = free.shape
+        # A border of walls around the map, so a neighbor never needs a bounds check
+        padded = np.zeros((width + 2, height + 2), dtype=np.uint8)
+        padded[1:-1, 1:-1] = free.T
+        self._attach(bytearray(padded.tobytes()), width, height)
+
+    def _attach(self, cells, width, height):
+        self.width, self.height = width, height
+        # Column-major ids (x major, y minor) order nodes like (x, y) tuples, so heap ties break as in a_star
+        self.stride = height + 2
+        self.cells = cells
+        self.size = len(cells)
+        # Left, right, up, down: the order of get_neighbors
+        self.offsets = (-self.stride, self.stride, -1, 1)
+
+    @classmethod
+    def from_lists(cls, grid):
+        return cls(np.array(grid, dtype=np.uint8))
+
+    # Grid over an existing padded cell buffer (e.g. shared memory), without copying it
+    @classmethod
+    def from_buffer(cls, cells, width, height):
+        grid = cls.__new__(cls)
+        grid._attach(cells, width, height)
+        return grid
+
+    def node(self, pos):
+        return (pos[0] + 1) * self.stride + pos[1] + 1
+
+    def pos(self, node):
+        x, y = divmod(node, self.stride)
+        return x - 1, y - 1
+
+    def is_free(self, pos):
+        return self.cells[self.node(pos)] == 1
+
+    def set_cell(self, pos, free):
+        self.cells[self.node(pos)] = 1 if free else 0
+
+    def to_array(self):
+        # (height, width) bool array of free cells
+        padded = np.frombuffer(bytes(self.cells), dtype=np.uint8).reshape(self.width + 2, self.stride)
+        return padded[1:-1, 1:-1].T != 0
+
+# Index dtype able to hold every node id of a grid
+def index_dtype(grid):
+    return np.int32 if grid.size < 2**31 else np.int64
+
+# Walk parent ids back to the start and turn them into (x, y) cells
+def flat_path(grid, parents, node):
+    path = []
+    while node >= 0:
+        path.append(grid.pos(node))
+        node = parents[node]
+    path.reverse()
+    return path
+
+# A* over an OccupancyGrid: array g-scores and parents indexed by node id instead of dicts
+# of tuples. Expands the same nodes in the same order as a_star, so the path is identical.
+def a_star_grid(grid, start, goal):
+    began = time.perf_counter()
+    stride, cells, offsets = grid.stride, grid.cells, grid.offsets
+    source, target = grid.node(start), grid.node(goal)
+    tx, ty = divmod(target, stride)
+    dtype = index_dtype(grid)
+    g_array = np.full(grid.size, -1, dtype=dtype)  # -1: not reached yet
+    parent_array = np.full(grid.size, -1, dtype=dtype)
+    # memoryviews index like lists (plain ints in and out) while the data stays in compact arrays
+    g_score, parents = memoryview(g_array), memoryview(parent_array)
+    state = bytearray(grid.size)
+    g_score[source] = 0
+    state[source] = OPEN
+    sx, sy = divmod(source, stride)
+    open_heap = [(abs(sx - tx) + abs(sy - ty), source)]
+    push, pop = heapq.heappush, heapq.heappop
+    expanded, pushed, max_open = 0, 1, 1
+    path = None
+
+    while open_heap:
+        _, current = pop(open_heap)
+        state[current] = CLOSED
+        expanded += 1
+
+        if current == target:
+            path = flat_path(grid, parents, current)
+            break
+
+        tentative_g = g_score[current] + 1
+        for offset in offsets:
+            neighbor = current + offset
+            if not cells[neighbor] or state[neighbor] == CLOSED:
+                continue
+            g = g_score[neighbor]
+            if g < 0 or tentative_g < g:
+                parents[neighbor] = current
+                g_score[neighbor] = tentative_g
+                if state[neighbor] != OPEN:
+                    x, y = divmod(neighbor, stride)
+                    push(open_heap, (tentative_g + abs(x - tx) + abs(y - ty), neighbor))
+                    state[neighbor] = OPEN
+                    pushed += 1
+        if len(open_heap) > max_open:
+            max_open = len(open_heap)
+
+    stats = {
+        "expanded": expanded,
+        "pushed": pushed,
+        "max_open": max_open,
+        "path_length": len(path) - 1 if path else None,
+        "seconds": time.perf_counter() - began,
+    }
+    return path, stats
+
+# Benchmark against a_star on generate_maze grids
+if __name__ == "__main__":
+    import tracemalloc
+    from AStarPathfinding import a_star, generate_maze
+
+    random.seed(0)
+    for size in (100, 300, 1000):
+        maze = generate_maze(size, size, obstacle_chance=0.25)
+        grid = OccupancyGrid.from_lists(maze)
+        start, goal = (1, 1), (size - 2, size - 2)
+
+        path, stats = a_star(maze, start, goal)
+        flat, flat_stats = a_star_grid(grid, start, goal)
+
+        # Peak memory of each search, in a second run since tracing slows them down
+        peaks = []
+        for search, args in ((a_star, (maze, start, goal)), (a_star_grid, (grid, start, goal))):
+            tracemalloc.start()
+            search(*args)
+            peaks.append(tracemalloc.get_traced_memory()[1] / 2**20)
+            tracemalloc.stop()
+
+        print(
+            f"{size}x{size}: a_star {stats['seconds'] * 1000:.0f} ms, {peaks[0]:.1f} MiB; "
+            f"a_star_grid {flat_stats['seconds'] * 1000:.0f} ms, {peaks[1]:.1f} MiB; "
+            f"expanded {stats['expanded']}, same path: {path == flat}"
+        )
@@ -0,0 +1,357 @@
+import heapq
+import itertools
+import random
+import time
+from collections import deque
+from GridAStar import OccupancyGrid
+
+# Border runs at least this long get an entrance at each end instead of one in the middle
+LONG_ENTRANCE = 6
+
+# HPA* (Botea, Mueller and Schaeffer): the map is cut into square clusters,
+# each border between two clusters gets entrance cells on both sides, and
+# the distances between the entrances of a cluster are computed once. A
+# query connects start and goal to the entrances of their own clusters,
+# searches that small abstract graph and then fills in each abstract edge
+# with a search confined to one cluster. Paths are near-optimal: within a
+# few percent of the shortest on most maps. 4-connected, unit costs, and
+# 1 = free as in AStarPathfinding.
+class HPAStar:
+    def __init__(self, grid, cluster_size=16):
+        if not isinstance(grid, OccupancyGrid):
+            grid = OccupancyGrid.from_lists(grid)
+        self.grid = grid
+        self.cluster_size = cluster_size
+        self.clusters_x = -(-grid.width // cluster_size)
+        self.clusters_y = -(-grid.height // cluster_size)
+        self._nodes = {}  # cluster -> abstract nodes (grid node ids) inside it
+        self._borders = {}  # (cx, cy, "h" or "v") -> entrance pairs across that border
+        self._refs = {}  # node -> number of entrances using it
+        self._intra = {}  # node -> {node: distance} within its cluster
+        self._inter = {}  # node -> {node: 1} across a border
+        self._segments = {}  # cluster -> {(a, b): refined path}
+        self._dirty_borders = set()
+        self._dirty_clusters = set()
+        began = time.perf_counter()
+        for cluster in self.clusters():
+            self._nodes[cluster] = set()
+            self._segments[cluster] = {}
+        for border in self.borders():
+            self._build_border(border)
+        for cluster in self.clusters():
+            self._build_cluster(cluster)
+        self.build_seconds = time.perf_counter() - began
+
+    def clusters(self):
+        return itertools.product(range(self.clusters_x), range(self.clusters_y))
+
+    def borders(self):
+        for cx, cy in self.clusters():
+            if cx + 1 < self.clusters_x:
+                yield cx, cy, "h"
+            if cy + 1 < self.clusters_y:
+                yield cx, cy, "v"
+
+    def cluster_of(self, pos):
+        return pos[0] // self.cluster_size, pos[1] // self.cluster_size
+
+    # Node count of the abstract graph
+    def __len__(self):
+        return len(self._refs)
+
+    # Entrance pairs on one border: maximal runs of cells free on both sides
+    def _build_border(self, border):
+        cx, cy, axis = border
+        size, grid = self.cluster_size, self.grid
+        if axis == "h":
+            x = (cx + 1) * size - 1
+            span = range(cy * size, min((cy + 1) * size, grid.height))
+            pairs = [(grid.node((x, y)), grid.node((x + 1, y))) for y in span]
+            other = (cx + 1, cy)
+        else:
+            y = (cy + 1) * size - 1
+            span = range(cx * size, min((cx + 1) * size, grid.width))
+            pairs = [(grid.node((x, y)), grid.node((x, y + 1))) for x in span]
+            other = (cx, cy + 1)
+
+        entrances = []
+        run = []
+        for a, b in pairs + [(None, None)]:
+            if a is not None and self.grid.cells[a] and self.grid.cells[b]:
+                run.append((a, b))
+                continue
+            if run:
+                if len(run) < LONG_ENTRANCE:
+                    entrances.append(run[len(run) // 2])
+                else:
+                    entrances += [run[0], run[-1]]
+                run = []
+
+        for a, b in entrances:
+            for node, cluster in ((a, (cx, cy)), (b, other)):
+                self._nodes[cluster].add(node)
+                self._refs[node] = self._refs.get(node, 0) + 1
+                self._intra.setdefault(node, {})
+                self._inter.setdefault(node, {})
+            self._inter[a][b] = self._inter[b][a] = 1
+        self._borders[border] = entrances
+
+    def _remove_border(self, border):
+        cx, cy, axis = border
+        other = (cx + 1, cy) if axis == "h" else (cx, cy + 1)
+        for a, b in self._borders.pop(border, ()):
+            self._inter[a].pop(b, None)
+            self._inter[b].pop(a, None)
+            for node, cluster in ((a, (cx, cy)), (b, other)):
+                self._refs[node] -= 1
+                if self._refs[node] == 0:
+                    del self._refs[node], self._intra[node], self._inter[node]
+                    self._nodes[cluster].discard(node)
+
+    # Distances between every pair of entrances of a cluster
+    def _build_cluster(self, cluster):
+        nodes = self._nodes[cluster]
+        for node in nodes:
+            self._intra[node] = {}
+        for node in nodes:
+            distances, _ = self._search(cluster, node, nodes)
+            for other in nodes:
+                if other != node and other in distances:
+                    self._intra[node][other] = distances[other]
+        self._segments[cluster] = {}
+
+    # Breadth-first search from source that never leaves the cluster; stops once every target is reached
+    def _search(self, cluster, source, targets=()):
+        stride, cells, offsets = self.grid.stride, self.grid.cells, self.grid.offsets
+        size = self.cluster_size
+        # Padded coordinates of the cluster's cells, as node ids decode to with divmod
+        x0, y0 = cluster[0] * size + 1, cluster[1] * size + 1
+        x1, y1 = min(x0 + size, self.grid.width + 1), min(y0 + size, self.grid.height + 1)
+        distances = {source: 0}
+        parents = {source: -1}
+        remaining = set(targets)
+        remaining.discard(source)
+        queue = deque([source])
+        while queue and (remaining or not targets):
+            current = queue.popleft()
+            for offset in offsets:
+                neighbor = current + offset
+                if neighbor in distances or not cells[neighbor]:
+                    continue
+                x, y = divmod(neighbor, stride)
+                if not (x0 <= x < x1 and y0 <= y < y1):
+                    continue
+                distances[neighbor] = distances[current] + 1
+                parents[neighbor] = current
+                remaining.discard(neighbor)
+                queue.append(neighbor)
+        return distances, parents
+
+    # Change one cell; only the clusters around it are rebuilt, at the next query
+    def set_cell(self, pos, free):
+        if self.grid.is_free(pos) == bool(free):
+            return
+        self.grid.set_cell(pos, free)
+        cluster = self.cluster_of(pos)
+        self._dirty_clusters.add(cluster)
+        x, y = pos
+        size = self.cluster_size
+        cx, cy = cluster
+        # A cell on a cluster edge belongs to the border shared with the next cluster
+        if x % size == size - 1 and cx + 1 < self.clusters_x:
+            self._dirty_borders.add((cx, cy, "h"))
+        if x % size == 0 and cx > 0:
+            self._dirty_borders.add((cx - 1, cy, "h"))
+        if y % size == size - 1 and cy + 1 < self.clusters_y:
+            self._dirty_borders.add((cx, cy, "v"))
+        if y % size == 0 and cy > 0:
+            self._dirty_borders.add((cx, cy - 1, "v"))
+
+    def _refresh(self):
+        if not self._dirty_borders and not self._dirty_clusters:
+            return 0
+        for border in self._dirty_borders:
+            self._remove_border(border)
+        for border in self._dirty_borders:
+            self._build_border(border)
+            cx, cy, axis = border
+            self._dirty_clusters.update([(cx, cy), (cx + 1, cy) if axis == "h" else (cx, cy + 1)])
+        rebuilt = len(self._dirty_clusters)
+        for cluster in self._dirty_clusters:
+            self._build_cluster(cluster)
+        self._dirty_borders.clear()
+        self._dirty_clusters.clear()
+        return rebuilt
+
+    # Abstract path (start, entrances..., goal) and its length, or (None, None)
+    def abstract_path(self, start, goal, stats=None):
+        return self._plan(start, goal, stats)[:2]
+
+    # The abstract path and length, plus the search trees from the start and from the goal
+    # inside their clusters, which also refine the first and last abstract edges
+    def _plan(self, start, goal, stats=None):
+        rebuilt = self._refresh()
+        if stats is not None:
+            stats["clusters_rebuilt"] = rebuilt
+        grid = self.grid
+        if not (grid.is_free(start) and grid.is_free(goal)):
+            return None, None, None, None
+        source, target = grid.node(start), grid.node(goal)
+        if source == target:
+            return [source], 0, None, None
+        start_cluster, goal_cluster = self.cluster_of(start), self.cluster_of(goal)
+
+        # Temporary edges from the start to its cluster's entrances and from the goal's entrances to the goal
+        reach, start_parents = self._search(start_cluster, source, self._nodes[start_cluster] | {target})
+        start_edges = {node: reach[node] for node in self._nodes[start_cluster] if node in reach}
+        if start_cluster == goal_cluster and target in reach:
+            start_edges[target] = reach[target]
+        start_edges.update(self._inter.get(source, {}))
+        reach, goal_parents = self._search(goal_cluster, target, self._nodes[goal_cluster])
+        goal_edges = {node: reach[node] for node in self._nodes[goal_cluster] if node in reach}
+
+        stride = grid.stride
+        gx, gy = divmod(target, stride)
+        sx, sy = divmod(source, stride)
+        g_score = {source: 0}
+        came_from = {source: -1}
+        closed = set()
+        # Ties on f go to the node nearest the goal
+        open_heap = [(abs(sx - gx) + abs(sy - gy), 0, source)]
+        expanded = 0
+        while open_heap:
+            _, _, current = heapq.heappop(open_heap)
+            if current in closed:
+                continue
+            closed.add(current)
+            expanded += 1
+            if current == target:
+                break
+            if current == source:
+                edges = start_edges.items()
+            else:
+                edges = itertools.chain(self._intra[current].items(), self._inter[current].items())
+            if current in goal_edges:
+                edges = itertools.chain(edges, [(target, goal_edges[current])])
+            for neighbor, cost in edges:
+                if neighbor in closed:
+                    continue
+                tentative_g = g_score[current] + cost
+                if neighbor not in g_score or tentative_g < g_score[neighbor]:
+                    g_score[neighbor] = tentative_g
+                    came_from[neighbor] = current
+                    x, y = divmod(neighbor, stride)
+                    h = abs(x - gx) + abs(y - gy)
+                    heapq.heappush(open_heap, (tentative_g + h, h, neighbor))
+        if stats is not None:
+            stats["abstract_expanded"] = expanded
+        if target not in closed:
+            return None, None, None, None
+        path = []
+        node = target
+        while node >= 0:
+            path.append(node)
+            node = came_from[node]
+        path.reverse()
+        return path, g_score[target], start_parents, goal_parents
+
+    # Cells of one abstract edge, without its first cell
+    def _refine(self, a, b, start_parents, goal_parents):
+        if b in self._inter.get(a, ()):
+            return [b]
+        segment = []
+        if start_parents is not None and start_parents.get(a) == -1 and b in start_parents:
+            # Leaving the start: the start's search tree holds the way
+            node = b
+            while node != a:
+                segment.append(node)
+                node = start_parents[node]
+            segment.reverse()
+            return segment
+        if goal_parents is not None and goal_parents.get(b) == -1 and a in goal_parents:
+            node = goal_parents[a]
+            while node != -1:
+                segment.append(node)
+                node = goal_parents[node]
+            return segment
+        cluster = self.cluster_of(self.grid.pos(a))
+        cached = (a in self._refs and b in self._refs)  # Only entrance-to-entrance segments are reused
+        segments = self._segments[cluster]
+        if cached and (a, b) in segments:
+            return segments[(a, b)]
+        _, parents = self._search(cluster, a, {b})
+        node = b
+        while node != a:
+            segment.append(node)
+            node = parents[node]
+        segment.reverse()
+        if cached:
+            segments[(a, b)] = segment
+        return segment
+
+    # Refined path as a generator of (x, y) cells, one abstract edge at a time, so an agent
+    # that replans before arriving never pays for the rest
+    def iter_path(self, start, goal):
+        abstract, _, start_parents, goal_parents = self._plan(start, goal)
+        if abstract is None:
+            return
+        yield start
+        for a, b in zip(abstract, abstract[1:]):
+            for node in self._refine(a, b, start_parents, goal_parents):
+                yield self.grid.pos(node)
+
+    def find_path(self, start, goal):
+        began = time.perf_counter()
+        stats = {}
+        abstract, cost, start_parents, goal_parents = self._plan(start, goal, stats)
+        path = None
+        if abstract is not None:
+            path = [start]
+            for a, b in zip(abstract, abstract[1:]):
+                path.extend(self.grid.pos(node) for node in self._refine(a, b, start_parents, goal_parents))
+        stats["abstract_nodes"] = len(abstract) if abstract else 0
+        stats["path_length"] = cost
+        stats["seconds"] = time.perf_counter() - began
+        return path, stats
+
+# Benchmark: repeated queries on one map against a_star_grid, then cell updates
+if __name__ == "__main__":
+    from AStarPathfinding import generate_maze
+    from GridAStar import a_star_grid
+
+    random.seed(0)
+    size = 512
+    maze = generate_maze(size, size, obstacle_chance=0.2)
+    free = [(x, y) for y in range(size) for x in range(size) if maze[y][x]]
+    queries = [(random.choice(free), random.choice(free)) for _ in range(300)]
+
+    planner = HPAStar(maze, cluster_size=16)
+    print(f"{size}x{size}: abstract graph of {len(planner)} nodes built in {planner.build_seconds:.2f} s")
+
+    # The first pass also fills the refined segment cache that the second one reuses
+    rates = []
+    for _ in range(2):
+        began = time.perf_counter()
+        results = [planner.find_path(start, goal) for start, goal in queries]
+        rates.append(len(queries) / (time.perf_counter() - began))
+
+    grid = OccupancyGrid.from_lists(maze)
+    began = time.perf_counter()
+    exact = [a_star_grid(grid, start, goal) for start, goal in queries[:50]]
+    astar_rate = 50 / (time.perf_counter() - began)
+
+    ratios = [
+        stats["path_length"] / reference["path_length"]
+        for (_, stats), (_, reference) in zip(results, exact)
+        if reference["path_length"]
+    ]
+    print(
+        f"HPA*: {rates[0]:.0f} queries/s cold, {rates[1]:.0f} warm; a_star_grid: {astar_rate:.1f} queries/s, "
+        f"path length {sum(ratios) / len(ratios):.3f}x a_star_grid's on average"
+    )
+
+    # Walls appearing: each change only rebuilds the clusters it touches
+    for _ in range(20):
+        planner.set_cell(random.choice(free), False)
+    stats = planner.find_path(*queries[0])[1]
+    print(f"20 cells changed: {stats['clusters_rebuilt']} clusters rebuilt in {stats['seconds'] * 1000:.0f} ms")
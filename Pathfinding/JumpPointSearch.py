@@ -0,0 +1,367 @@
+import heapq
+import math
+import random
+import time
+import numpy as np
+from GridAStar import OccupancyGrid
+
+SQRT2 = math.sqrt(2)
+
+# Jump Point Search over an OccupancyGrid with uniform move costs.
+#
+# 8-connected (diagonal=True): diagonal moves cost sqrt(2) and may not cut
+# corners (both orthogonal cells must be free). Straight scans stop at cells
+# with a forced neighbor; diagonal scans stop where a straight scan would.
+#
+# 4-connected: of the equally short paths, the canonical one moves
+# horizontally first and turns off a vertical run only when a wall forced
+# it. Vertical scans stop at forced neighbors; horizontal scans stop where a
+# vertical scan from the cell would find one, the way diagonal scans work
+# in the 8-connected case.
+
+# Grid moves as (dx, dy)
+STRAIGHT = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+DIAGONAL = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+
+def _sign(v):
+    return (v > 0) - (v < 0)
+
+# Octile distance; equal to Manhattan on a 4-connected grid when one of dx, dy is 0
+def octile(dx, dy):
+    dx, dy = abs(dx), abs(dy)
+    return max(dx, dy) + (SQRT2 - 1) * min(dx, dy)
+
+# Scan until a jump point (returned as a node id) or a wall (-1)
+def _jump_vertical(cells, stride, node, dy, goal):
+    while True:
+        node += dy
+        if not cells[node]:
+            return -1
+        if node == goal:
+            return node
+        # A wall beside the cell we came from, open beside this one: only a turn here reaches that side
+        if (cells[node - stride] and not cells[node - stride - dy]) or (cells[node + stride] and not cells[node + stride - dy]):
+            return node
+
+def _jump_horizontal(cells, stride, node, dx, goal):
+    step = dx * stride
+    while True:
+        node += step
+        if not cells[node]:
+            return -1
+        if node == goal:
+            return node
+        if _jump_vertical(cells, stride, node, 1, goal) >= 0 or _jump_vertical(cells, stride, node, -1, goal) >= 0:
+            return node
+
+def _jump_straight8(cells, stride, node, dx, dy, goal):
+    step = dx * stride + dy
+    side = 1 if dx else stride
+    while True:
+        node += step
+        if not cells[node]:
+            return -1
+        if node == goal:
+            return node
+        if (cells[node - side] and not cells[node - side - step]) or (cells[node + side] and not cells[node + side - step]):
+            return node
+
+def _jump_diagonal8(cells, stride, node, dx, dy, goal):
+    while True:
+        if not (cells[node + dx * stride] and cells[node + dy]):  # No corner cutting
+            return -1
+        node += dx * stride + dy
+        if not cells[node]:
+            return -1
+        if node == goal:
+            return node
+        if _jump_straight8(cells, stride, node, dx, 0, goal) >= 0 or _jump_straight8(cells, stride, node, 0, dy, goal) >= 0:
+            return node
+
+# Directions worth scanning from a node entered moving (dx, dy); (0, 0) for the start
+def _directions(cells, stride, node, dx, dy, diagonal):
+    if dx == 0 and dy == 0:
+        return STRAIGHT + DIAGONAL if diagonal else STRAIGHT
+    if not diagonal:
+        if dx:
+            return [(dx, 0), (0, -1), (0, 1)]
+        moves = [(0, dy)]
+        for side in (-1, 1):
+            if cells[node + side * stride] and not cells[node + side * stride - dy]:
+                moves.append((side, 0))
+        return moves
+    if dx and dy:
+        return [(dx, 0), (0, dy), (dx, dy)]
+    moves = [(dx, dy)]
+    # A sideways cell behind a wall could not be reached diagonally from the parent, so the
+    # path turns here: sideways, and diagonally past it when the straight cell is free too
+    sx, sy = (0, 1) if dx else (1, 0)
+    back = dx * stride + dy
+    for s in (-1, 1):
+        side = s * (sx * stride + sy)
+        if cells[node + side] and not cells[node + side - back]:
+            moves.append((s * sx, s * sy))
+            if cells[node + back]:
+                moves.append((dx + s * sx, dy + s * sy))
+    return moves
+
+# JPS+: for every cell and direction, the distance to the next jump point
+# (positive) or minus the number of free steps before a wall (zero or
+# negative). Goal-independent, so it is built once per map and turns each
+# scan into a lookup; the goal is handled at query time.
+class JumpTable:
+    def __init__(self, grid, diagonal=False):
+        self.grid = grid
+        self.diagonal = diagonal
+        width, stride = grid.width + 2, grid.stride
+        free = np.frombuffer(bytes(grid.cells), dtype=np.uint8).reshape(width, stride) != 0
+        self._tables = {}
+        vertical = {dy: self._distances(free, (0, dy), self._forced(free, 0, dy)) for dy in (-1, 1)}
+        self._tables.update({(0, dy): table for dy, table in vertical.items()})
+        if not diagonal:
+            turns = (vertical[-1] > 0) | (vertical[1] > 0)
+            for dx in (-1, 1):
+                self._tables[(dx, 0)] = self._distances(free, (dx, 0), turns)
+        else:
+            for dx in (-1, 1):
+                self._tables[(dx, 0)] = self._distances(free, (dx, 0), self._forced(free, dx, 0))
+            for dx, dy in DIAGONAL:
+                stops = (self._tables[(dx, 0)] > 0) | (self._tables[(0, dy)] > 0)
+                self._tables[(dx, dy)] = self._distances(free, (dx, dy), stops)
+        self._views = {move: memoryview(table.ravel()) for move, table in self._tables.items()}
+
+    # Cells with a forced neighbor when entered moving (dx, dy) in a straight line
+    @staticmethod
+    def _forced(free, dx, dy):
+        forced = np.zeros_like(free)
+        inner = (slice(1, -1), slice(1, -1))
+
+        def at(ox, oy):
+            return free[1 + ox:free.shape[0] - 1 + ox, 1 + oy:free.shape[1] - 1 + oy]
+
+        sx, sy = (0, 1) if dx else (1, 0)
+        for s in (-1, 1):
+            forced[inner] |= at(s * sx, s * sy) & ~at(s * sx - dx, s * sy - dy)
+        return forced
+
+    # Distances along (dx, dy), one line of cells at a time, walking against the move direction
+    @staticmethod
+    def _distances(free, move, stops):
+        dx, dy = move
+        table = np.zeros(free.shape, dtype=np.int32)
+        width, height = free.shape
+        if dx:
+            ys = np.arange(1, height - 1)
+            order = range(width - 2, 0, -1) if dx > 0 else range(1, width - 1)
+            for x in order:
+                can = free[x, ys] & free[x + dx, ys + dy]
+                if dy:
+                    can &= free[x + dx, ys] & free[x, ys + dy]
+                after = table[x + dx, ys + dy]
+                step = np.where(after > 0, after + 1, after - 1)
+                table[x, ys] = np.where(can, np.where(stops[x + dx, ys + dy], 1, step), 0)
+        else:
+            xs = np.arange(1, width - 1)
+            order = range(height - 2, 0, -1) if dy > 0 else range(1, height - 1)
+            for y in order:
+                can = free[xs, y] & free[xs, y + dy]
+                after = table[xs, y + dy]
+                step = np.where(after > 0, after + 1, after - 1)
+                table[xs, y] = np.where(can, np.where(stops[xs, y + dy], 1, step), 0)
+        return table
+
+    # Next node along a move from node: a jump point, a cell in line with the goal, or -1
+    def jump(self, node, dx, dy, goal, gx, gy):
+        stride = self.grid.stride
+        distance = self._views[(dx, dy)][node]
+        reach = abs(distance)
+        x, y = divmod(node, stride)
+        if dx and dy:
+            # Goal-bounding: stop where the goal's row or column is reached, if that is in reach
+            if _sign(gx - x) == dx and _sign(gy - y) == dy:
+                steps = min(abs(gx - x), abs(gy - y))
+                if steps <= reach:
+                    return node + steps * (dx * stride + dy)
+        elif dx and _sign(gx - x) == dx and (not self.diagonal or gy == y):
+            # 4-connected: the vertical scan from the goal's column may reach it
+            steps = abs(gx - x)
+            if steps <= reach:
+                return node + steps * dx * stride
+        elif dy and gx == x and _sign(gy - y) == dy:
+            steps = abs(gy - y)
+            if steps <= reach:
+                return goal
+        return node + distance * (dx * stride + dy) if distance > 0 else -1
+
+# Jump point search with the call shape of a_star; grid is a list-of-lists map or an
+# OccupancyGrid. table is an optional JumpTable built for the same grid.
+def jump_point_search(grid, start, goal, diagonal=False, table=None):
+    began = time.perf_counter()
+    if not isinstance(grid, OccupancyGrid):
+        grid = OccupancyGrid.from_lists(grid)
+    if table is not None and (table.grid is not grid or table.diagonal != diagonal):
+        raise ValueError("The jump table was built for another grid or connectivity.")
+    stride, cells = grid.stride, grid.cells
+    source, target = grid.node(start), grid.node(goal)
+    gx, gy = divmod(target, stride)
+
+    def heuristic(node):
+        x, y = divmod(node, stride)
+        return octile(gx - x, gy - y) if diagonal else abs(gx - x) + abs(gy - y)
+
+    g_score = {source: 0}
+    came_from = {source: -1}
+    closed = set()
+    # Ties on f go to the node nearest the goal, so a plateau of equal f is crossed, not flooded
+    open_heap = [(heuristic(source), heuristic(source), source)]
+    expanded, pushed, max_open = 0, 1, 1
+    found = False
+
+    while open_heap:
+        _, _, current = heapq.heappop(open_heap)
+        if current in closed:
+            continue
+        closed.add(current)
+        expanded += 1
+        if current == target:
+            found = True
+            break
+
+        x, y = divmod(current, stride)
+        parent = came_from[current]
+        px, py = divmod(parent, stride) if parent >= 0 else (x, y)
+        for dx, dy in _directions(cells, stride, current, _sign(x - px), _sign(y - py), diagonal):
+            if table is not None:
+                node = table.jump(current, dx, dy, target, gx, gy)
+            elif not diagonal:
+                if dx:
+                    node = _jump_horizontal(cells, stride, current, dx, target)
+                else:
+                    node = _jump_vertical(cells, stride, current, dy, target)
+            elif dx and dy:
+                node = _jump_diagonal8(cells, stride, current, dx, dy, target)
+            else:
+                node = _jump_straight8(cells, stride, current, dx, dy, target)
+            if node < 0 or node in closed:
+                continue
+            nx, ny = divmod(node, stride)
+            tentative_g = g_score[current] + octile(nx - x, ny - y)
+            if node not in g_score or tentative_g < g_score[node] - 1e-9:
+                g_score[node] = tentative_g
+                came_from[node] = current
+                h = heuristic(node)
+                heapq.heappush(open_heap, (tentative_g + h, h, node))
+                pushed += 1
+        if len(open_heap) > max_open:
+            max_open = len(open_heap)
+
+    path = None
+    if found:
+        # Fill in the straight and diagonal runs between consecutive jump points
+        jump_points = []
+        node = target
+        while node >= 0:
+            jump_points.append(grid.pos(node))
+            node = came_from[node]
+        jump_points.reverse()
+        path = [jump_points[0]]
+        for (ax, ay), (bx, by) in zip(jump_points, jump_points[1:]):
+            sx, sy = _sign(bx - ax), _sign(by - ay)
+            for i in range(1, max(abs(bx - ax), abs(by - ay)) + 1):
+                path.append((ax + i * sx, ay + i * sy))
+
+    stats = {
+        "expanded": expanded,
+        "pushed": pushed,
+        "max_open": max_open,
+        "path_length": len(path) - 1 if path else None,
+        "path_cost": g_score[target] if found else None,
+        "seconds": time.perf_counter() - began,
+    }
+    return path, stats
+
+# Plain 8-connected A* with the same move rules, as the reference for diagonal JPS
+def a_star_octile(grid, start, goal):
+    began = time.perf_counter()
+    if not isinstance(grid, OccupancyGrid):
+        grid = OccupancyGrid.from_lists(grid)
+    stride, cells = grid.stride, grid.cells
+    source, target = grid.node(start), grid.node(goal)
+    gx, gy = divmod(target, stride)
+    g_score = {source: 0}
+    came_from = {source: -1}
+    closed = set()
+    open_heap = [(0, 0, source)]
+    expanded = 0
+    moves = [(dx, dy, dx * stride + dy, octile(dx, dy)) for dx, dy in STRAIGHT + DIAGONAL]
+    while open_heap:
+        _, _, current = heapq.heappop(open_heap)
+        if current in closed:
+            continue
+        closed.add(current)
+        expanded += 1
+        if current == target:
+            break
+        for dx, dy, step, cost in moves:
+            node = current + step
+            if not cells[node] or node in closed or (dx and dy and not (cells[current + dx * stride] and cells[current + dy])):
+                continue
+            tentative_g = g_score[current] + cost
+            if node not in g_score or tentative_g < g_score[node] - 1e-9:
+                g_score[node] = tentative_g
+                came_from[node] = current
+                x, y = divmod(node, stride)
+                h = octile(gx - x, gy - y)
+                heapq.heappush(open_heap, (tentative_g + h, h, node))
+    path = None
+    if target in closed:
+        path = []
+        node = target
+        while node >= 0:
+            path.append(grid.pos(node))
+            node = came_from[node]
+        path.reverse()
+    stats = {
+        "expanded": expanded,
+        "path_length": len(path) - 1 if path else None,
+        "path_cost": g_score[target] if path else None,
+        "seconds": time.perf_counter() - began,
+    }
+    return path, stats
+
+# Benchmark against A* on open and cluttered maps
+if __name__ == "__main__":
+    from AStarPathfinding import generate_maze
+    from GridAStar import a_star_grid
+
+    random.seed(0)
+    for size, obstacles in ((200, 0.3), (200, 0.05), (1000, 0.01)):
+        maze = generate_maze(size, size, obstacle_chance=obstacles)
+        grid = OccupancyGrid.from_lists(maze)
+        start, goal = (1, 1), (size - 2, size - 2)
+        print(f"{size}x{size}, {obstacles:.0%} walls")
+
+        reference, reference_stats = a_star_grid(grid, start, goal)
+        began = time.perf_counter()
+        table = JumpTable(grid)
+        build = time.perf_counter() - began
+        for name, (path, stats) in (
+            ("A* (4-connected)", (reference, reference_stats)),
+            ("JPS", jump_point_search(grid, start, goal)),
+            ("JPS+", jump_point_search(grid, start, goal, table=table)),
+        ):
+            print(
+                f"  {name:<18} length {stats['path_length']}, {stats['expanded']:>7} expanded, "
+                f"{stats['seconds'] * 1000:8.1f} ms"
+            )
+        print(f"  JPS+ table built in {build * 1000:.0f} ms")
+
+        reference, reference_stats = a_star_octile(grid, start, goal)
+        table = JumpTable(grid, diagonal=True)
+        for name, (path, stats) in (
+            ("A* (8-connected)", (reference, reference_stats)),
+            ("JPS", jump_point_search(grid, start, goal, diagonal=True)),
+            ("JPS+", jump_point_search(grid, start, goal, diagonal=True, table=table)),
+        ):
+            cost = f"{stats['path_cost']:.3f}" if path else None
+            print(f"  {name:<18} cost {cost}, {stats['expanded']:>7} expanded, {stats['seconds'] * 1000:8.1f} ms")
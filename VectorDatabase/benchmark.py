@@ -0,0 +1,201 @@
+import json
+import os
+import pickle
+import platform
+import time
+import numpy as np
+from vectordatabase import VectorDatabase
+
+# Database settings of each benchmarked backend, as a function of the dataset size and dimension;
+# None marks a backend that does not apply to that dataset
+BACKENDS = {
+    "flat": lambda size, dim: {"index": None},
+    "flat-float32": lambda size, dim: {"index": None, "dtype": np.float32},
+    "flat-int8": lambda size, dim: {"index": None, "dtype": np.int8, "keep_originals": True},
+    "tree": lambda size, dim: {"index": "tree"} if dim <= 16 else None,
+    "ivf": lambda size, dim: {"index": "ivf", "nlist": int(np.sqrt(size)), "nprobe": 8, "seed": 0},
+    "hnsw": lambda size, dim: {"index": "hnsw", "M": 16, "ef_construction": 100, "ef_search": 64, "seed": 0},
+    "pq": lambda size, dim: {"index": "pq", "m": dim // 4, "rerank": 100, "seed": 0} if dim % 4 == 0 else None,
+    "lsh": lambda size, dim: {"index": "lsh", "tables": 8, "bits": 8, "width": 4.0 * np.sqrt(dim), "seed": 0},
+}
+# Sizes above which a backend is skipped, for those whose build is too slow to wait for at every size.
+# HNSW runs up to 50000 rows, where at d=64 its single queries overtake the flat scan
+MAX_SIZE = {"hnsw": 50000}
+
+def make_dataset(size, dim, num_queries=200, clusters=64, seed=0):
+    """Gaussian clusters of unequal spread, with queries drawn from the same distribution.
+
+    Uniform random data is the worst case for every index (no neighbor is
+    much nearer than the others); clustered data is closer to embeddings.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(scale=4.0, size=(clusters, dim))
+    spread = rng.uniform(0.5, 2.0, size=clusters)
+
+    def sample(n):
+        labels = rng.integers(clusters, size=n)
+        return centers[labels] + rng.normal(size=(n, dim)) * spread[labels, None]
+
+    return sample(size), sample(num_queries)
+
+def load_dataset(path, num_queries=200, seed=0):
+    """Vectors of a .npy file, with num_queries of them held out as queries."""
+    vectors = np.load(path, mmap_mode="r")
+    held_out = np.random.default_rng(seed).choice(len(vectors), num_queries, replace=False)
+    keep = np.ones(len(vectors), dtype=bool)
+    keep[held_out] = False
+    return np.asarray(vectors[keep]), np.asarray(vectors[held_out])
+
+def ground_truth(data, queries, k, metric="l2"):
+    """Exact k nearest ids of each query, from a brute-force scan at float64."""
+    exact = VectorDatabase(dim=data.shape[1], index=None, metric=metric)
+    exact.add_vectors(data)
+    ids, _, _ = exact.query_batch(queries, k, exact=True)
+    return ids
+
+def index_bytes(db):
+    """Memory of the stored columns plus the index structures."""
+    storage = db.storage
+    total = sum(storage._column(name).nbytes for name in storage._column_names())
+    if db.index is not None:
+        total += len(pickle.dumps(db.index, protocol=pickle.HIGHEST_PROTOCOL))
+        tree = getattr(db.index, "_tree", None)  # Not pickled, rebuilt on load
+        if tree is not None:
+            total += tree.data.nbytes + tree.indices.nbytes
+    return total
+
+def run_backend(name, params, data, queries, truth, k=10, metric="l2", batch_size=None):
+    """Build one database over data and measure it; returns one result record."""
+    start = time.perf_counter()
+    db = VectorDatabase(dim=data.shape[1], metric=metric, **params)
+    db.add_vectors(data)
+    if db.index is not None and db.index.requires_training:
+        db.train()
+    if db.index is not None and hasattr(db.index, "build"):
+        db.index.build()
+    build_seconds = time.perf_counter() - start
+
+    search_params = {"refine": 50} if params.get("keep_originals") else {}
+    latencies = np.empty(len(queries))
+    found = []
+    for i, vector in enumerate(queries):
+        start = time.perf_counter()
+        ids, _ = db.search(vector, k, **search_params)
+        latencies[i] = time.perf_counter() - start
+        found.append(ids)
+
+    start = time.perf_counter()
+    for first in range(0, len(queries), batch_size or len(queries)):
+        db.query_batch(queries[first:first + (batch_size or len(queries))], k, **search_params)
+    batch_seconds = time.perf_counter() - start
+
+    memory = index_bytes(db)
+    recall = np.mean([len(np.intersect1d(want, got)) / len(want) for want, got in zip(truth, found)])
+    return {
+        "backend": name,
+        "size": len(data),
+        "dim": data.shape[1],
+        "k": k,
+        "params": {key: np.dtype(value).name if key == "dtype" else value for key, value in params.items()},
+        "build_seconds": build_seconds,
+        "memory_bytes": memory,
+        "bytes_per_vector": memory / len(data),
+        "single_qps": len(queries) / latencies.sum(),
+        "batch_qps": len(queries) / batch_seconds,
+        "p50_ms": float(np.percentile(latencies, 50)) * 1e3,
+        "p99_ms": float(np.percentile(latencies, 99)) * 1e3,
+        "recall": float(recall),
+    }
+
+def run(sizes=(10000, 50000, 100000), dims=(16, 64), backends=None, num_queries=200, k=10, metric="l2",
+        data_path=None, seed=0, log=print):
+    """Benchmark every backend on every dataset; returns the result records.
+
+    With data_path, the vectors of that .npy file replace the synthetic
+    datasets (sizes and dims are then ignored).
+    """
+    if data_path is not None:
+        datasets = [load_dataset(data_path, num_queries, seed)]
+    else:
+        datasets = (make_dataset(size, dim, num_queries, seed=seed) for size in sizes for dim in dims)
+    results = []
+    for data, queries in datasets:
+        truth = ground_truth(data, queries, k, metric)
+        for name in backends or BACKENDS:
+            params = BACKENDS[name](len(data), data.shape[1])
+            if params is None or len(data) > MAX_SIZE.get(name, np.inf):
+                continue
+            if metric == "ip" and params.get("index") == "tree":
+                continue
+            result = run_backend(name, params, data, queries, truth, k, metric)
+            result["metric"] = metric
+            results.append(result)
+            if log:
+                log(
+                    f"{name:>13} n={result['size']:<8} d={result['dim']:<4} build {result['build_seconds']:7.2f}s  "
+                    f"{result['bytes_per_vector']:7.0f} B/vec  single {result['single_qps']:8.0f} QPS  "
+                    f"batch {result['batch_qps']:8.0f} QPS  p50 {result['p50_ms']:6.2f}ms  "
+                    f"p99 {result['p99_ms']:6.2f}ms  recall@{k} {result['recall']:.3f}"
+                )
+    return results
+
+def write_results(results, path):
+    """Save the records with the machine they ran on, as JSON."""
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+def compare(baseline, results, qps_tolerance=0.2, recall_tolerance=0.01):
+    """Regressions of results against a baseline report: (backend, size, dim, measure, old, new) tuples.
+
+    QPS may drop by qps_tolerance (a fraction, timings are noisy) and recall
+    by recall_tolerance before a row is reported.
+    """
+    with open(baseline) as f:
+        old = {(r["backend"], r["size"], r["dim"], r["k"], r["metric"]): r for r in json.load(f)["results"]}
+    regressions = []
+    for new in results:
+        before = old.get((new["backend"], new["size"], new["dim"], new["k"], new["metric"]))
+        if before is None:
+            continue
+        for field in ("single_qps", "batch_qps"):
+            if new[field] < before[field] * (1 - qps_tolerance):
+                regressions.append((new["backend"], new["size"], new["dim"], field, before[field], new[field]))
+        if new["recall"] < before["recall"] - recall_tolerance:
+            regressions.append((new["backend"], new["size"], new["dim"], "recall", before["recall"], new["recall"]))
+    return regressions
+
+# Example usage: python benchmark.py --sizes 10000 50000 100000 --dims 16 64 --output results.json
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build time, memory, QPS, latency and recall of VectorDatabase backends.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 100000])
+    parser.add_argument("--dims", type=int, nargs="+", default=[16, 64])
+    parser.add_argument("--backends", nargs="+", choices=sorted(BACKENDS))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--metric", default="l2", choices=["l2", "cosine", "ip"])
+    parser.add_argument("--data", help=".npy file of vectors to use instead of synthetic data")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", help="earlier --output file to check for regressions")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.dims, args.backends, args.queries, args.k, args.metric, args.data)
+    write_results(results, args.output)
+    print(f"Wrote {len(results)} results to {args.output}")
+    if args.baseline:
+        regressions = compare(args.baseline, results)
+        for backend, size, dim, field, before, after in regressions:
+            print(f"Regression: {backend} n={size} d={dim} {field} {before:.3f} -> {after:.3f}")
+        if regressions:
+            raise SystemExit(1)
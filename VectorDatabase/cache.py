@@ -0,0 +1,130 @@
+import time
+from collections import OrderedDict
+import numpy as np
+from distances import pairwise
+from filters import matches
+
+# Relative tolerance on the k-th distance when deciding whether a new vector could enter a cached answer
+RADIUS_SLACK = 1e-6
+
+class QueryCache:
+    """Size-bounded LRU cache of search results, with an optional time to live.
+
+    Keys are the query vector rounded to a grid of step resolution, plus k,
+    the filter and the search parameters, so repeats of a query (and vectors
+    within rounding noise of it) share one entry. Entries are only dropped
+    when a write could change them: a removal invalidates the answers holding
+    the removed row, and an add invalidates the answers whose filter the new
+    vector matches and whose k-th distance it would beat.
+    """
+
+    def __init__(self, max_entries=1024, ttl=None, resolution=1e-6):
+        self.max_entries = max_entries
+        self.ttl = ttl  # Seconds an entry stays valid, None for no limit
+        self.resolution = resolution
+        self._entries = OrderedDict()  # key -> (slot, rows, distances, where, refined, expires), oldest first
+        self._by_row = {}  # row -> keys of the cached answers that contain it
+        self._free = list(range(max_entries))
+        self._queries = None  # (max_entries, dim) query of each slot
+        self._radius = np.full(max_entries, -np.inf)  # k-th distance of each slot; inf when fewer than k rows
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def key(self, vector, k, exact, where, refine, search_params):
+        grid = np.rint(np.asarray(vector, dtype=np.float64) / self.resolution).astype(np.int64)
+        frozen = tuple(sorted((field, _hashable(value)) for field, value in (where or {}).items()))
+        return grid.tobytes(), k, exact, frozen, refine, tuple(sorted(search_params.items()))
+
+    def get(self, key):
+        """Cached (rows, distances) for a key, or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[5] is not None and entry[5] < time.monotonic():
+            self._drop(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1].copy(), entry[2].copy()
+
+    def put(self, key, vector, k, where, rows, distances):
+        if self.max_entries <= 0:
+            return
+        if key in self._entries:
+            self._drop(key)
+        if not self._free:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+        slot = self._free.pop()
+        if self._queries is None:
+            self._queries = np.empty((self.max_entries, len(vector)))
+        self._queries[slot] = vector
+        self._radius[slot] = distances[-1] if len(rows) >= k else np.inf
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        refined = bool(key[4])  # Ranked by the full-precision originals rather than the stored vectors
+        self._entries[key] = (slot, rows.copy(), distances.copy(), where, refined, expires)
+        for row in rows.tolist():
+            self._by_row.setdefault(row, set()).add(key)
+
+    def _drop(self, key):
+        slot, rows = self._entries.pop(key)[:2]
+        self._radius[slot] = -np.inf
+        self._free.append(slot)
+        for row in rows.tolist():
+            keys = self._by_row.get(row)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_row[row]
+
+    def removed(self, row):
+        """Invalidate the answers that contain a removed row."""
+        for key in list(self._by_row.get(row, ())):
+            self._drop(key)
+            self.invalidations += 1
+
+    def added(self, vectors, originals, metadata, metric):
+        """Invalidate the answers that newly added vectors could enter.
+
+        vectors are the rows as stored and originals their full-precision
+        copies, each compared with the answers ranked in the same space.
+        """
+        entries = list(self._entries.items())
+        slots = np.array([entry[0] for _, entry in entries])
+        refined = np.array([entry[4] for _, entry in entries])
+        radius = self._radius[slots]
+        limit = (radius + RADIUS_SLACK * np.abs(radius))[:, None]
+        closer = np.zeros((len(entries), len(vectors)), dtype=bool)
+        for space, rows in ((vectors, ~refined), (originals, refined)):
+            if rows.any():
+                closer[rows] = pairwise(self._queries[slots[rows]], space, metric) <= limit[rows]
+        for (key, entry), hit in zip(entries, closer):
+            where = entry[3]
+            if hit.any() and (not where or any(matches(where, metadata[i]) for i in np.flatnonzero(hit))):
+                self._drop(key)
+                self.invalidations += 1
+
+    def clear(self):
+        """Drop every entry (after a compaction or an index rebuild moved the rows)."""
+        for key in list(self._entries):
+            self._drop(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+def _hashable(value):
+    return tuple(sorted(value, key=repr)) if isinstance(value, (list, tuple, set, frozenset)) else value
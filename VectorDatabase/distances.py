@@ -0,0 +1,31 @@
+import numpy as np
+
+# l2: squared euclidean, cosine: 1 - cosine similarity, ip: negated inner product
+METRICS = ("l2", "cosine", "ip")
+
+def pairwise(a, b, metric="l2"):
+    """Distance between every row of a and every row of b; smaller is closer."""
+    dots = np.atleast_2d(a) @ np.atleast_2d(b).T
+    if metric == "cosine":
+        return 1.0 - dots
+    if metric == "ip":
+        return -dots
+    d = (a * a).sum(axis=-1).reshape(-1, 1) - 2.0 * dots + (b * b).sum(axis=-1).reshape(1, -1)
+    return np.maximum(d, 0.0, out=d)
+
+def top_k(values, k):
+    """Positions of the k smallest values along the last axis, sorted ascending.
+
+    Uses argpartition so only the k winners are sorted, not the whole row.
+    """
+    values = np.asarray(values)
+    n = values.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(values.shape[:-1] + (0,), dtype=np.int64)
+    if k < n:
+        part = np.argpartition(values, k - 1, axis=-1)[..., :k]
+    else:
+        part = np.broadcast_to(np.arange(n), values.shape).copy()
+    order = np.argsort(np.take_along_axis(values, part, axis=-1), axis=-1)
+    return np.take_along_axis(part, order, axis=-1)
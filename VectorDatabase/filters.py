@@ -0,0 +1,78 @@
+import numpy as np
+
+def matches(where, meta):
+    """Whether one metadata value satisfies a where-clause, with the semantics of MetadataIndex.match."""
+    if not isinstance(meta, dict):
+        return False
+    for field, value in where.items():
+        values = value if isinstance(value, (list, tuple, set, frozenset)) else [value]
+        if field not in meta or meta[field] not in values:
+            return False
+    return True
+
+class MetadataIndex:
+    """Inverted index from each (field, value) pair of dict metadata to the rows holding it.
+
+    A where-clause is answered by turning the posting lists of its values into
+    a row bitmap, so the distance kernels only ever see matching rows.
+    """
+
+    def __init__(self):
+        self._rows = {}  # (field, value) -> growable array of rows, in increasing order
+        self._sizes = {}
+
+    def add(self, row, meta):
+        """Index every hashable field of a metadata dict."""
+        if not isinstance(meta, dict):
+            return
+        for field, value in meta.items():
+            key = (field, value)
+            try:
+                hash(key)
+            except TypeError:
+                continue
+            self._append(key, row)
+
+    def _append(self, key, row):
+        rows = self._rows.get(key)
+        size = self._sizes.get(key, 0)
+        if rows is None or size == len(rows):
+            grown = np.empty(max(8, 2 * size), dtype=np.int64)
+            if rows is not None:
+                grown[:size] = rows
+            self._rows[key] = rows = grown
+        rows[size] = row
+        self._sizes[key] = size + 1
+
+    def rows(self, field, value):
+        """Rows whose metadata has field == value."""
+        key = (field, value)
+        if key not in self._rows:
+            return np.empty(0, dtype=np.int64)
+        return self._rows[key][:self._sizes[key]]
+
+    def match(self, where, size):
+        """Bitmap of the rows matching every field of a where-clause.
+
+        A list, tuple or set value matches any of its members.
+        """
+        mask = np.ones(size, dtype=bool)
+        for field, value in where.items():
+            values = value if isinstance(value, (list, tuple, set, frozenset)) else [value]
+            field_mask = np.zeros(size, dtype=bool)
+            for v in values:
+                field_mask[self.rows(field, v)] = True
+            mask &= field_mask
+        return mask
+
+    def compact(self, keep):
+        """Renumber the rows after the storage dropped the rows where keep is False."""
+        new_rows = np.cumsum(keep) - 1
+        for key in list(self._rows):
+            rows = self.rows(*key)
+            rows = new_rows[rows[keep[rows]]]
+            if len(rows) == 0:
+                del self._rows[key], self._sizes[key]
+                continue
+            self._rows[key][:len(rows)] = rows
+            self._sizes[key] = len(rows)
@@ -0,0 +1,247 @@
+import heapq
+import math
+import numpy as np
+
+# Candidates expanded per step of a layer search; their new neighbors are scored in one call
+EXPAND_BATCH = 8
+
+class HNSWIndex:
+    """Hierarchical Navigable Small World graph over the rows of a VectorStorage.
+
+    Node n is storage row n. Tombstoned rows stay in the graph to route searches
+    but are never returned.
+    """
+
+    requires_training = False
+
+    def __init__(self, storage, M=16, ef_construction=200, ef_search=50, seed=None):
+        self.storage = storage
+        self.M = M
+        self.M0 = 2 * M  # Level 0 keeps twice as many links
+        self.ef_construction = max(ef_construction, M)
+        self.ef_search = ef_search
+        self.level_mult = 1.0 / math.log(max(M, 2))
+        self.rng = np.random.default_rng(seed)
+        self.reset()
+
+    def __getstate__(self):
+        # The storage is saved separately and re-attached on load
+        state = self.__dict__.copy()
+        state["storage"] = None
+        return state
+
+    def reset(self):
+        """Drop the whole graph."""
+        self.neighbors = []  # neighbors[node][level] -> list of nodes
+        self.entry_point = None
+        self.max_level = -1
+
+    def add(self, rows, vectors):
+        """Insert rows into the graph one at a time."""
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        vectors = np.atleast_2d(vectors)
+        for row, vector in zip(rows, vectors):
+            self._insert(row, vector)
+
+    def _insert(self, row, vector):
+        if row != len(self.neighbors):
+            raise ValueError("HNSW nodes must be added in storage row order.")
+        level = int(-math.log(1.0 - self.rng.random()) * self.level_mult)
+        node = row
+        self.neighbors.append([[] for _ in range(level + 1)])
+        if self.entry_point is None:
+            self.entry_point, self.max_level = node, level
+            return
+
+        score = self.storage.scorer(vector)
+        entry = self.entry_point
+        entry_dist = float(score([entry])[0])
+        # Greedy descent through the levels above the new node
+        for lc in range(self.max_level, level, -1):
+            entry, entry_dist = self._greedy(score, entry, entry_dist, lc)
+
+        candidates = [(entry_dist, entry)]
+        for lc in range(min(level, self.max_level), -1, -1):
+            candidates = self._search_layer(score, candidates, self.ef_construction, lc)
+            max_links = self.M0 if lc == 0 else self.M
+            selected = self._select(candidates, self.M)
+            self.neighbors[node][lc] = selected
+            for other in selected:
+                links = self.neighbors[other][lc]
+                links.append(node)
+                if len(links) > max_links:
+                    self._shrink(other, lc, max_links)
+
+        if level > self.max_level:
+            self.entry_point, self.max_level = node, level
+
+    def _greedy(self, score, entry, entry_dist, level):
+        """Walk to the closest node on one level; score is a storage.scorer() of the query."""
+        changed = True
+        while changed:
+            changed = False
+            links = self.neighbors[entry][level]
+            if not links:
+                break
+            dists = score(links)
+            best = int(np.argmin(dists))
+            if dists[best] < entry_dist:
+                entry, entry_dist = links[best], float(dists[best])
+                changed = True
+        return entry, entry_dist
+
+    def _search_layer(self, score, entries, ef, level, skip_deleted=False):
+        """Best-first search on one level; returns up to ef (distance, node) pairs sorted by distance."""
+        neighbors = self.neighbors
+        heappush, heappop = heapq.heappush, heapq.heappop
+        visited = {node for _, node in entries}
+        candidates = list(entries)
+        heapq.heapify(candidates)
+        # Max-heap of the best nodes so far; deleted nodes are traversed but never returned
+        alive = self.storage.alive
+        results = [(-d, n) for d, n in entries if not skip_deleted or alive[n]]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heappop(results)
+
+        while candidates:
+            bound = -results[0][0] if len(results) >= ef else math.inf
+            # The closest few candidates within the bound are expanded together, so all
+            # their new neighbors are scored in one call
+            fresh = []
+            expanded = 0
+            while candidates and expanded < EXPAND_BATCH and candidates[0][0] <= bound:
+                _, node = heappop(candidates)
+                expanded += 1
+                for n in neighbors[node][level]:
+                    if n not in visited:
+                        visited.add(n)
+                        fresh.append(n)
+            if not expanded:
+                break
+            if not fresh:
+                continue
+            dists = score(fresh)
+            if len(results) >= ef:
+                # Only the nodes that beat the current worst result go on the heaps
+                closer = np.flatnonzero(dists < bound).tolist()
+                dists, fresh = dists[closer], [fresh[i] for i in closer]
+            for d, n in zip(dists.tolist(), fresh):
+                if len(results) < ef or d < -results[0][0]:
+                    heappush(candidates, (d, n))
+                    if skip_deleted and not alive[n]:
+                        continue
+                    heappush(results, (-d, n))
+                    if len(results) > ef:
+                        heappop(results)
+        return sorted((-d, n) for d, n in results)
+
+    def _between(self, nodes):
+        """Distances between every pair of the given rows."""
+        vectors = self.storage.get(nodes)
+        dots = vectors @ vectors.T
+        if self.storage.metric == "l2":
+            # From the cached norms rather than the vectors
+            sq_norms = self.storage.sq_norms[nodes]
+            return sq_norms[:, None] + sq_norms[None, :] - 2.0 * dots
+        return (1.0 if self.storage.metric == "cosine" else 0.0) - dots
+
+    def _select(self, candidates, m):
+        """Neighbor selection heuristic: keep candidates closer to the base than to any kept neighbor.
+
+        candidates are (distance, node) pairs sorted by distance.
+        """
+        if len(candidates) <= m:
+            return [n for _, n in candidates]
+        nodes = [n for _, n in candidates]
+        dists = np.array([d for d, _ in candidates])
+        return self._prune(nodes, dists, self._between(nodes), m)
+
+    def _prune(self, nodes, dists, between, m):
+        """The heuristic of _select, given the candidates' distances to the base and to each other."""
+        # Bit j of row i is set when candidate j is closer to candidate i than to the base,
+        # so keeping i blocks j; rows are read as Python ints to keep the loop cheap
+        width = -(-len(nodes) // 8)
+        rows = np.packbits(between < dists[None, :], axis=1, bitorder="little").tobytes()
+        blocked = 0
+        kept, pruned = [], []
+        for i in range(len(nodes)):
+            if len(kept) >= m:
+                break
+            if blocked >> i & 1:
+                pruned.append(nodes[i])
+                continue
+            kept.append(nodes[i])
+            blocked |= int.from_bytes(rows[i * width:(i + 1) * width], "little")
+        # Top up with the closest pruned candidates so nodes keep m links
+        return kept + pruned[:m - len(kept)]
+
+    def _shrink(self, node, level, max_links):
+        links = self.neighbors[node][level]
+        # One pairwise matrix gives both the distances to the node and between its links
+        between = self._between([node] + links)
+        order = np.argsort(between[0, 1:])
+        inner = between[1:, 1:][np.ix_(order, order)]
+        self.neighbors[node][level] = self._prune([links[i] for i in order], between[0, 1:][order], inner, max_links)
+
+    def compact(self, keep):
+        """Remove the nodes of the rows the storage dropped and renumber the rest.
+
+        Called after the storage compaction, so distances use the new rows. A
+        node that linked to a removed one inherits that node's links on the
+        same level, so routes through it survive; lists that grow too long are
+        pruned with the usual heuristic.
+        """
+        size = len(self.neighbors)
+        keep = keep[:size]
+        kept = keep.tolist()
+        new_rows = (np.cumsum(keep) - 1).tolist()
+        neighbors = []
+        for node in range(size):
+            if not kept[node]:
+                continue
+            node_links = []
+            for level, links in enumerate(self.neighbors[node]):
+                merged = [n for n in links if kept[n]]
+                if len(merged) < len(links):
+                    seen = set(merged)
+                    seen.add(node)
+                    for removed in links:
+                        if kept[removed]:
+                            continue
+                        for n in self.neighbors[removed][level]:
+                            if kept[n] and n not in seen:
+                                seen.add(n)
+                                merged.append(n)
+                merged = [new_rows[n] for n in merged]
+                max_links = self.M0 if level == 0 else self.M
+                if len(merged) > max_links:
+                    dists = self.storage.scorer(self.storage.get(new_rows[node]))(merged)
+                    order = np.argsort(dists)
+                    merged = self._select([(dists[i], merged[i]) for i in order], max_links)
+                node_links.append(merged)
+            neighbors.append(node_links)
+        self.neighbors = neighbors
+        if self.entry_point is not None and not kept[self.entry_point]:
+            self.entry_point, self.max_level = None, -1
+            for node, node_links in enumerate(self.neighbors):
+                if len(node_links) - 1 > self.max_level:
+                    self.entry_point, self.max_level = node, len(node_links) - 1
+        elif self.entry_point is not None:
+            self.entry_point = new_rows[self.entry_point]
+
+    def search(self, vector, k, ef_search=None):
+        """Approximate k nearest rows and their distances."""
+        if self.entry_point is None:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        ef = max(ef_search or self.ef_search, k)
+        score = self.storage.scorer(vector)
+        entry = self.entry_point
+        entry_dist = float(score([entry])[0])
+        for lc in range(self.max_level, 0, -1):
+            entry, entry_dist = self._greedy(score, entry, entry_dist, lc)
+        found = self._search_layer(score, [(entry_dist, entry)], ef, 0, skip_deleted=True)[:k]
+        return np.array([n for _, n in found], dtype=np.int64), np.array([d for d, _ in found])
+
+    def __len__(self):
+        return len(self.neighbors)
@@ -0,0 +1,96 @@
+import numpy as np
+from scipy.cluster.vq import kmeans2
+from distances import pairwise, top_k
+
+class IVFIndex:
+    """Inverted-file index: k-means coarse centroids with one posting list of rows per centroid."""
+
+    requires_training = True
+
+    def __init__(self, storage, nlist=100, nprobe=8, train_iters=20, seed=None):
+        self.storage = storage
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iters = train_iters
+        self.seed = seed
+        self.centroids = None
+        self._lists = []
+        self._sizes = None
+
+    def __getstate__(self):
+        # The storage is saved separately and re-attached on load
+        state = self.__dict__.copy()
+        state["storage"] = None
+        return state
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def train(self, vectors):
+        """Learn the coarse centroids from a sample of vectors."""
+        vectors = np.asarray(vectors, dtype=np.float64)
+        if len(vectors) == 0:
+            raise ValueError("Cannot train an IVF index without vectors.")
+        nlist = min(self.nlist, len(vectors))
+        self.centroids, _ = kmeans2(vectors, nlist, iter=self.train_iters, minit="++", seed=self.seed)
+        if self.storage.metric == "cosine":
+            # Spherical k-means: unit centroids so assignment follows cosine similarity
+            norms = np.linalg.norm(self.centroids, axis=1, keepdims=True)
+            self.centroids /= np.where(norms == 0, 1, norms)
+        self.reset()
+
+    def reset(self):
+        """Empty every posting list, keeping the centroids."""
+        nlist = 0 if self.centroids is None else len(self.centroids)
+        self._lists = [np.empty(16, dtype=np.int64) for _ in range(nlist)]
+        self._sizes = np.zeros(nlist, dtype=np.int64)
+
+    def compact(self, keep):
+        """Renumber the posting lists after the storage dropped the rows where keep is False."""
+        new_rows = np.cumsum(keep) - 1
+        for list_id in range(len(self._lists)):
+            rows = self._lists[list_id][:self._sizes[list_id]]
+            rows = new_rows[rows[keep[rows]]]
+            self._lists[list_id][:len(rows)] = rows
+            self._sizes[list_id] = len(rows)
+
+    def assign(self, vectors):
+        """Nearest centroid for each vector."""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float64))
+        return np.argmin(pairwise(vectors, self.centroids, self.storage.metric), axis=1)
+
+    def add(self, rows, vectors):
+        """Append rows to the posting lists of their nearest centroids (no retraining)."""
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        for list_id, row in zip(self.assign(vectors), rows):
+            self._append(list_id, row)
+
+    def _append(self, list_id, row):
+        size = self._sizes[list_id]
+        posting = self._lists[list_id]
+        if size == len(posting):
+            grown = np.empty(len(posting) * 2, dtype=np.int64)
+            grown[:size] = posting[:size]
+            self._lists[list_id] = posting = grown
+        posting[size] = row
+        self._sizes[list_id] = size + 1
+
+    def candidates(self, vector, nprobe=None):
+        """Rows stored in the nprobe posting lists closest to the vector."""
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        vector = np.asarray(vector, dtype=np.float64)
+        distances = pairwise(vector, self.centroids, self.storage.metric)[0]
+        probes = np.argpartition(distances, nprobe - 1)[:nprobe]
+        return np.concatenate([self._lists[p][:self._sizes[p]] for p in probes])
+
+    def search(self, vector, k, nprobe=None):
+        """Exact distances over the probed posting lists; returns the k nearest rows and their distances."""
+        candidates = self.candidates(vector, nprobe)
+        candidates = candidates[self.storage.alive[candidates]]
+        distances = self.storage.distances(vector, candidates)
+        order = top_k(distances, k)
+        return candidates[order], distances[order]
+
+    def list_sizes(self):
+        return self._sizes.copy()
@@ -0,0 +1,183 @@
+import heapq
+import numpy as np
+from distances import top_k
+
+class LSHIndex:
+    """Locality-sensitive hashing: several hash tables whose buckets group nearby rows.
+
+    cosine and ip use random-hyperplane hashes (one sign bit per hyperplane);
+    l2 uses p-stable hashes floor((a.x + b) / width) with Gaussian a. A query
+    probes its own bucket in every table plus the neighboring buckets it came
+    closest to falling into (multi-probe), and the union of those rows is
+    re-ranked with exact distances. Adding a row costs tables * bits
+    projections and one bucket append per table, whatever the index size.
+    """
+
+    requires_training = False
+
+    def __init__(self, storage, tables=8, bits=12, width=4.0, probes=8, seed=None):
+        self.storage = storage
+        self.tables = tables
+        self.bits = bits  # Hash functions concatenated into one bucket key per table
+        self.width = width  # l2 only: bucket width, in the units of the vectors
+        self.probes = probes  # Extra buckets visited per table, likeliest to hold neighbors first
+        self.rng = np.random.default_rng(seed)
+        self.projections = None  # (tables * bits, dim), drawn on the first add
+        self.offsets = None
+        # A bucket key is the integer combination of its hash values, so stepping one
+        # hash to a neighboring value moves the key by a known amount
+        self.weights = self.rng.integers(1, 2**62, size=bits, dtype=np.int64)
+        self._template_cache = {}
+        self.reset()
+
+    def __getstate__(self):
+        # The storage is saved separately and re-attached on load
+        state = self.__dict__.copy()
+        state["storage"] = None
+        return state
+
+    def reset(self):
+        """Empty every bucket, keeping the hash functions."""
+        self._buckets = [{} for _ in range(self.tables)]
+        self._size = 0
+
+    @property
+    def hyperplanes(self):
+        return self.storage.metric != "l2"
+
+    def _hash(self, vectors):
+        """Bucket keys of each vector in every table, shape (n, tables), and the raw hash values."""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float64))
+        if self.projections is None:
+            self.projections = self.rng.normal(size=(self.tables * self.bits, vectors.shape[1]))
+            self.offsets = self.rng.uniform(0, self.width, size=self.tables * self.bits)
+        projected = (vectors @ self.projections.T).reshape(len(vectors), self.tables, self.bits)
+        if self.hyperplanes:
+            values = projected
+            codes = (projected > 0).astype(np.int64)
+        else:
+            values = (projected + self.offsets.reshape(self.tables, self.bits)) / self.width
+            codes = np.floor(values).astype(np.int64)
+        return codes @ self.weights, codes, values
+
+    def _moves(self, codes, values):
+        """Single-hash moves of a query in every table, sorted by score: (key steps, hashes), each (tables, n_moves).
+
+        The score of a move is the squared distance from the query to the
+        bucket boundary it crosses; l2 hashes can move down or up.
+        """
+        if self.hyperplanes:
+            # Flip a sign bit; projections near zero flip most easily
+            scores = values * values
+            steps = (1 - 2 * codes) * self.weights
+            hashes = np.broadcast_to(np.arange(self.bits), scores.shape)
+        else:
+            frac = values - codes
+            scores = np.concatenate([frac * frac, (1 - frac) ** 2], axis=-1)
+            steps = np.broadcast_to(np.concatenate([-self.weights, self.weights]), scores.shape)
+            hashes = np.broadcast_to(np.tile(np.arange(self.bits), 2), scores.shape)
+        order = np.argsort(scores, axis=-1)
+        return np.take_along_axis(steps, order, axis=-1), np.take_along_axis(hashes, order, axis=-1)
+
+    def _templates(self, probes):
+        """Perturbation sets as positions into the sorted moves, likeliest first, padded with -1.
+
+        Lv et al.'s query-directed multi-probe with the expected score of the
+        j-th smallest move in place of the query's own scores, so the heap
+        runs once per probe count instead of once per query. Twice as many
+        sets as probes are kept since some are invalid for a given query.
+        """
+        if probes in self._template_cache:
+            return self._template_cache[probes]
+        m = self.bits
+        n = m if self.hyperplanes else 2 * m
+        j = np.arange(1, n + 1, dtype=np.float64)
+        scale = 4 * (m + 1) * (m + 2)
+        expected = j * (j + 1) / scale
+        if not self.hyperplanes:
+            # Moves past the first m cross the far boundary of some hash
+            far = 2 * m + 1 - j
+            expected = np.where(j <= m, expected, 1 - far / (m + 1) + far * (far + 1) / scale)
+        sets = []
+        heap = [(expected[0], (0,))]
+        while heap and len(sets) < 2 * probes:
+            score, chosen = heapq.heappop(heap)
+            last = chosen[-1]
+            if last + 1 < n:
+                heapq.heappush(heap, (score - expected[last] + expected[last + 1], chosen[:-1] + (last + 1,)))
+                heapq.heappush(heap, (score + expected[last + 1], chosen + (last + 1,)))
+            sets.append(chosen)
+        width = max(map(len, sets))
+        templates = np.array([chosen + (-1,) * (width - len(chosen)) for chosen in sets], dtype=np.int64)
+        self._template_cache[probes] = templates
+        return templates
+
+    def _probe_keys(self, keys, codes, values, probes):
+        """Keys of the buckets to visit, one array per table starting with the query's own bucket."""
+        if not probes:
+            return keys[:, None]
+        steps, hashes = self._moves(codes, values)
+        templates = self._templates(probes)
+        used = templates >= 0
+        picked = np.where(used, templates, 0)
+        set_steps = np.where(used, steps[:, picked], 0).sum(axis=-1)
+        set_hashes = np.where(used, hashes[:, picked], -1 - np.arange(templates.shape[1]))
+        # Moving one hash both ways at once is not a bucket
+        set_hashes.sort(axis=-1)
+        valid = (np.diff(set_hashes, axis=-1) != 0).all(axis=-1)
+        valid &= np.cumsum(valid, axis=-1) <= probes
+        return [np.concatenate([[key], key + step[ok]]) for key, step, ok in zip(keys, set_steps, valid)]
+
+    def add(self, rows, vectors):
+        """Append rows to their bucket in every table; rows must come in storage order."""
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        if len(rows) and rows[0] != self._size:
+            raise ValueError("LSH rows must be added in storage row order.")
+        keys, _, _ = self._hash(vectors)
+        for row, row_keys in zip(rows.tolist(), keys.tolist()):
+            for buckets, key in zip(self._buckets, row_keys):
+                buckets.setdefault(key, []).append(row)
+        self._size += len(rows)
+
+    def compact(self, keep):
+        """Renumber the buckets after the storage dropped the rows where keep is False."""
+        keep = keep[:self._size]
+        kept = keep.tolist()
+        new_rows = (np.cumsum(keep) - 1).tolist()
+        for buckets in self._buckets:
+            for key in list(buckets):
+                rows = [new_rows[row] for row in buckets[key] if kept[row]]
+                if rows:
+                    buckets[key] = rows
+                else:
+                    del buckets[key]
+        self._size = int(keep.sum())
+
+    def candidates(self, vector, probes=None):
+        """Rows sharing one of the probed buckets with the vector in at least one table."""
+        probes = self.probes if probes is None else probes
+        keys, codes, values = self._hash(vector)
+        found = []
+        for buckets, table_keys in zip(self._buckets, self._probe_keys(keys[0], codes[0], values[0], probes)):
+            for key in table_keys.tolist():
+                bucket = buckets.get(key)
+                if bucket:
+                    found.append(bucket)
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+    def search(self, vector, k, probes=None):
+        """Exact distances over the candidate rows; returns the k nearest rows and their distances."""
+        candidates = self.candidates(vector, probes)
+        candidates = candidates[self.storage.alive[candidates]]
+        distances = self.storage.distances(vector, candidates)
+        order = top_k(distances, k)
+        return candidates[order], distances[order]
+
+    def bucket_sizes(self):
+        """Number of rows in each non-empty bucket, for every table."""
+        return [np.array([len(bucket) for bucket in buckets.values()]) for buckets in self._buckets]
+
+    def __len__(self):
+        return self._size
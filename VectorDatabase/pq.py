@@ -0,0 +1,142 @@
+import numpy as np
+from scipy.cluster.vq import kmeans2
+from distances import top_k
+
+class PQIndex:
+    """Product quantization: each vector is stored as m one-byte codes into per-subspace codebooks."""
+
+    requires_training = True
+
+    def __init__(self, storage, m=8, nbits=8, rerank=0, train_iters=20, seed=None):
+        if not 1 <= nbits <= 8:
+            raise ValueError("nbits must be between 1 and 8 so codes fit in one byte.")
+        self.storage = storage
+        self.m = m
+        self.ksub = 2 ** nbits
+        self.rerank = rerank  # Number of ADC candidates re-scored against the original vectors
+        self.train_iters = train_iters
+        self.seed = seed
+        self.codebooks = None  # (m, ksub, dsub)
+        self.reset()
+
+    def __getstate__(self):
+        # The storage is saved separately and re-attached on load
+        state = self.__dict__.copy()
+        state["storage"] = None
+        return state
+
+    @property
+    def trained(self):
+        return self.codebooks is not None
+
+    def train(self, vectors):
+        """Learn one k-means codebook per subspace."""
+        vectors = np.asarray(vectors, dtype=np.float64)
+        if len(vectors) == 0:
+            raise ValueError("Cannot train a PQ index without vectors.")
+        dim = vectors.shape[1]
+        if dim % self.m:
+            raise ValueError(f"Dimension {dim} is not divisible by m={self.m}.")
+        dsub = dim // self.m
+        ksub = min(self.ksub, len(vectors))
+        self.codebooks = np.empty((self.m, ksub, dsub))
+        for j in range(self.m):
+            sub = vectors[:, j * dsub:(j + 1) * dsub]
+            self.codebooks[j], _ = kmeans2(sub, ksub, iter=self.train_iters, minit="points", seed=self.seed)
+        self.reset()
+
+    def reset(self):
+        """Forget every stored code, keeping the codebooks."""
+        self._codes = np.empty((1024, self.m), dtype=np.uint8)
+        self._size = 0
+
+    def encode(self, vectors):
+        """Index of the nearest centroid in every subspace."""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float64))
+        _, ksub, dsub = self.codebooks.shape
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            sub = vectors[:, j * dsub:(j + 1) * dsub]
+            centroids = self.codebooks[j]
+            d2 = (
+                (sub * sub).sum(axis=1)[:, None]
+                - 2.0 * sub @ centroids.T
+                + (centroids * centroids).sum(axis=1)[None, :]
+            )
+            codes[:, j] = np.argmin(d2, axis=1)
+        return codes
+
+    def decode(self, codes):
+        """Approximate vectors rebuilt from their codes."""
+        codes = np.atleast_2d(codes)
+        return np.concatenate([self.codebooks[j][codes[:, j]] for j in range(self.m)], axis=1)
+
+    def add(self, rows, vectors):
+        """Encode vectors; rows are appended in storage order."""
+        codes = self.encode(vectors)
+        end = self._size + len(codes)
+        if end > len(self._codes):
+            grown = np.empty((max(end, 2 * len(self._codes)), self.m), dtype=np.uint8)
+            grown[:self._size] = self._codes[:self._size]
+            self._codes = grown
+        self._codes[self._size:end] = codes
+        self._size = end
+
+    def compact(self, keep):
+        """Drop the codes of the rows the storage dropped; the rest keep their order."""
+        codes = self.codes[keep[:self._size]]
+        self._codes[:len(codes)] = codes
+        self._size = len(codes)
+
+    @property
+    def codes(self):
+        return self._codes[:self._size]
+
+    def distance_table(self, vector):
+        """Distance contribution of every centroid of each subspace for one query, shape (m, ksub).
+
+        Squared distances for l2; negated sub-vector dot products for ip and
+        cosine, so the summed lookups give the negated inner product.
+        """
+        vector = np.asarray(vector, dtype=np.float64).ravel()
+        sub = vector.reshape(self.m, 1, -1)
+        if self.storage.metric == "l2":
+            return ((self.codebooks - sub) ** 2).sum(axis=2)
+        return -(self.codebooks * sub).sum(axis=2)
+
+    def search(self, vector, k, rerank=None):
+        """Asymmetric distance search, optionally re-ranking the best candidates exactly."""
+        rerank = self.rerank if rerank is None else rerank
+        table = self.distance_table(vector)
+        # Sum of table lookups: one per subspace for every stored code
+        distances = table[np.arange(self.m), self.codes].sum(axis=1)
+        if self.storage.metric == "cosine":
+            distances += 1.0
+        distances[~self.storage.alive] = np.inf
+
+        shortlist = min(max(k, rerank), self.storage.live_count)
+        if shortlist == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        candidates = np.argpartition(distances, shortlist - 1)[:shortlist]
+        if rerank:
+            distances = self.storage.distances(vector, candidates)
+        else:
+            distances = distances[candidates]
+        order = top_k(distances, k)
+        return candidates[order], distances[order]
+
+    def code_bytes(self):
+        """Bytes of codes per vector."""
+        return self.m * self._codes.itemsize
+
+    def memory_per_vector(self):
+        """Bytes one vector takes in RAM: its codes plus what the storage keeps of it.
+
+        An in-memory storage holds the full row. A file-backed one (a database
+        created with path=..., or reopened with open()) leaves the vectors on
+        disk, where a search reads just the rows it re-ranks; what stays
+        resident is the codes and the one-byte alive flag every search scans.
+        """
+        if self.storage.path is not None:
+            return self.code_bytes() + self.storage.alive.itemsize
+        return self.code_bytes() + self.storage.bytes_per_vector()
@@ -0,0 +1,319 @@
+import asyncio
+import collections
+import itertools
+import json
+import operator
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from cache import _hashable
+from vectordatabase import VectorDatabase
+
+# Latencies kept for the percentiles in stats()
+LATENCY_WINDOW = 10000
+
+class BatchingServer:
+    """Asyncio front-end that answers concurrent queries with batched calls to a VectorDatabase.
+
+    A request waits at most window seconds for others to arrive (or until
+    max_batch are waiting), then the whole batch goes through one
+    query_batch call, so brute-force batches become a single matrix product.
+    Requests with different filters or search parameters go in separate
+    query_batch calls; requests asking for a different k share one call at
+    the largest k and are cut down afterwards. Batches run on one worker
+    thread, so the event loop keeps accepting requests meanwhile; writes to
+    the database should go through run() to be serialized with them.
+    """
+
+    def __init__(self, db, window=0.002, max_batch=256):
+        self.db = db
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []  # (vector, k, group, future, submitted, (exact, where, search_params)) not yet in a batch
+        self._wakeup = None
+        self._full = None
+        self._task = None
+        self._closing = False
+        self._executor = None
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._batch_sizes = collections.Counter()
+        self.requests = self.batches = 0
+        self.compute_seconds = 0.0
+        self._started = None
+
+    async def start(self):
+        if self._task is None:
+            self._closing = False
+            self._wakeup = asyncio.Event()
+            self._full = asyncio.Event()
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            self._started = time.perf_counter()
+
+    async def close(self):
+        """Answer what is already queued or running, then stop."""
+        if self._task is None:
+            return
+        # The batch loop drains the queue without waiting out the window, then returns
+        self._closing = True
+        self._wakeup.set()
+        self._full.set()
+        await self._task
+        self._task = None
+        self._closing = False
+        self._executor.shutdown()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def query(self, vector, k=1, exact=False, where=None, **search_params):
+        """Ids, distances and metadata of the k nearest neighbors of one vector, like a row of query_batch."""
+        if self._closing:
+            raise RuntimeError("The server is closing.")
+        # A malformed request fails here, on its own, instead of inside a shared batch
+        k = operator.index(k)
+        vector = np.asarray(vector, dtype=np.float64)
+        dim = self.db.storage.dim
+        if vector.ndim != 1 or (dim is not None and len(vector) != dim):
+            raise ValueError(f"Expected a vector of dimension {dim}, got shape {vector.shape}.")
+        await self.start()
+        group = _group(exact, where, search_params)
+        future = asyncio.get_running_loop().create_future()
+        request = (exact, where, search_params)
+        self._pending.append((vector, k, group, future, time.perf_counter(), request))
+        self._wakeup.set()
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+        return await future
+
+    async def run(self, fn, *args, **kwargs):
+        """Call fn on the worker thread between batches, e.g. server.run(db.add_vector, vector)."""
+        await self.start()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, lambda: fn(*args, **kwargs))
+
+    async def _run(self):
+        while not (self._closing and not self._pending):
+            await self._wakeup.wait()
+            if not self._closing and len(self._pending) < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush()
+
+    async def _flush(self):
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        if not self._pending:
+            self._wakeup.clear()
+        if len(self._pending) < self.max_batch:
+            self._full.clear()
+        if not batch:
+            return
+        start = time.perf_counter()
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self._executor, self._execute, batch)
+        except Exception as exc:
+            # Only this batch fails; the loop goes on with the next one
+            results = [exc] * len(batch)
+        self.compute_seconds += time.perf_counter() - start
+        self.batches += 1
+        self._batch_sizes[len(batch)] += 1
+        done = time.perf_counter()
+        for (_, _, _, future, submitted, _), result in zip(batch, results):
+            self.requests += 1
+            self._latencies.append(done - submitted)
+            if future.done():  # The caller gave up waiting
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _execute(self, batch):
+        """Answer a batch on the worker thread; one query_batch call per group of compatible requests."""
+        results = [None] * len(batch)
+        groups = {}
+        for i, (_, _, group, _, _, _) in enumerate(batch):
+            groups.setdefault(group, []).append(i)
+        for members in groups.values():
+            try:
+                self._execute_group(batch, members, results)
+            except Exception as exc:
+                if len(members) == 1:
+                    results[members[0]] = exc
+                    continue
+                # Retry one by one, so only the request at fault gets the error
+                for i in members:
+                    try:
+                        self._execute_group(batch, [i], results)
+                    except Exception as exc:
+                        results[i] = exc
+        return results
+
+    def _execute_group(self, batch, members, results):
+        # Every member asks for the same thing; the first one's arguments stand for all
+        exact, where, search_params = batch[members[0]][5]
+        k = max(batch[i][1] for i in members)
+        queries = np.stack([batch[i][0] for i in members])
+        ids, distances, metadata = self.db.query_batch(queries, k, exact=exact, where=where, **search_params)
+        for row, i in enumerate(members):
+            found = min(batch[i][1], len(metadata[row]))
+            results[i] = (ids[row, :found], distances[row, :found], metadata[row][:found])
+
+    def stats(self):
+        """Throughput, batch sizes and latency percentiles (over the last LATENCY_WINDOW requests)."""
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        latencies = np.array(self._latencies)
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch": self.requests / self.batches if self.batches else 0.0,
+            "max_batch": max(self._batch_sizes, default=0),
+            "qps": self.requests / elapsed if elapsed else 0.0,
+            "compute_seconds": self.compute_seconds,
+            "p50_ms": float(np.percentile(latencies, 50)) * 1e3 if len(latencies) else 0.0,
+            "p99_ms": float(np.percentile(latencies, 99)) * 1e3 if len(latencies) else 0.0,
+        }
+
+    async def serve(self, host="127.0.0.1", port=0):
+        """Listen for QueryClient connections; returns the asyncio server (its port is in .sockets).
+
+        The protocol is one JSON object per line each way. Requests carry an
+        id, the vector, k and optionally where and search parameters; answers
+        echo the id with ids, distances and metadata, or an error message. A
+        connection can have many requests in flight and answers come back as
+        they are ready.
+        """
+        await self.start()
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def _handle(self, reader, writer):
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                task = asyncio.get_running_loop().create_task(self._answer(json.loads(line), writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+
+    async def _answer(self, request, writer):
+        reply = {"id": request.get("id")}
+        try:
+            ids, distances, metadata = await self.query(
+                request["vector"], request.get("k", 1), request.get("exact", False), request.get("where"),
+                **request.get("params", {})
+            )
+            reply.update(ids=ids.tolist(), distances=distances.tolist(), metadata=metadata)
+        except Exception as exc:
+            reply["error"] = f"{type(exc).__name__}: {exc}"
+        writer.write(json.dumps(reply, default=str).encode() + b"\n")
+        await writer.drain()
+
+class QueryClient:
+    """Client for BatchingServer.serve(); concurrent query() calls share one connection."""
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._ids = itertools.count()
+        self._waiting = {}  # request id -> future
+        self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=0):
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def query(self, vector, k=1, exact=False, where=None, **search_params):
+        """(ids, distances, metadata) of the k nearest neighbors, as the server's query() returns them."""
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[request_id] = future
+        request = {"id": request_id, "vector": np.asarray(vector, dtype=float).tolist(), "k": k, "exact": exact}
+        if where:
+            request["where"] = where
+        if search_params:
+            request["params"] = search_params
+        self._writer.write(json.dumps(request).encode() + b"\n")
+        await self._writer.drain()
+        reply = await future
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return np.array(reply["ids"], dtype=np.int64), np.array(reply["distances"]), reply["metadata"]
+
+    async def _listen(self):
+        while line := await self._reader.readline():
+            reply = json.loads(line)
+            future = self._waiting.pop(reply["id"], None)
+            if future is not None and not future.done():
+                future.set_result(reply)
+        for future in self._waiting.values():
+            future.set_exception(ConnectionError("The server closed the connection."))
+
+    async def close(self):
+        self._writer.close()
+        await self._writer.wait_closed()
+        await self._listener
+
+def _group(exact, where, search_params):
+    """Key under which requests share a query_batch call; a request whose arguments cannot be
+    hashed gets a key of its own, so it goes alone instead of failing the grouping."""
+    try:
+        where = tuple(sorted((field, _hashable(value)) for field, value in (where or {}).items()))
+        group = exact, where, tuple(sorted((name, _frozen(value)) for name, value in search_params.items()))
+        hash(group)
+        return group
+    except TypeError:
+        return object()
+
+def _frozen(value):
+    """Hashable stand-in for a search parameter; unlike a filter value, the order of a list counts."""
+    if isinstance(value, dict):
+        return dict, tuple(sorted((key, _frozen(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return type(value), tuple(_frozen(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset, frozenset(_frozen(item) for item in value)
+    return value
+
+# Example usage
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    db = VectorDatabase(dim=64, dtype=np.float32)
+    db.add_vectors(rng.normal(size=(100000, 64)), metadata=[{"item": i} for i in range(100000)])
+    queries = rng.normal(size=(2000, 64))
+
+    start = time.perf_counter()
+    expected = [db.search(vector, k=10)[0] for vector in queries]
+    print(f"One query per call: {len(queries) / (time.perf_counter() - start):.0f} QPS")
+
+    async def main():
+        for window, max_batch in ((0.001, 64), (0.002, 256)):
+            async with BatchingServer(db, window=window, max_batch=max_batch) as server:
+                found = await asyncio.gather(*(server.query(vector, k=10) for vector in queries))
+                same = all((ids == want).all() for (ids, _, _), want in zip(found, expected))
+                stats = server.stats()
+                print(
+                    f"window={window * 1e3:.0f}ms max_batch={max_batch}: {stats['qps']:.0f} QPS, "
+                    f"mean batch {stats['mean_batch']:.0f}, p50 {stats['p50_ms']:.1f}ms, "
+                    f"p99 {stats['p99_ms']:.1f}ms, same results: {same}"
+                )
+
+        # The same server over a local socket
+        async with BatchingServer(db) as server:
+            listener = await server.serve()
+            client = await QueryClient.connect(*listener.sockets[0].getsockname()[:2])
+            found = await asyncio.gather(*(client.query(vector, k=10) for vector in queries[:500]))
+            same = all((ids == want).all() for (ids, _, _), want in zip(found, expected))
+            print(f"Socket client: {server.stats()['qps']:.0f} QPS, same results: {same}, first:", found[0][2][:2])
+            await client.close()
+            listener.close()
+            await listener.wait_closed()
+
+    asyncio.run(main())
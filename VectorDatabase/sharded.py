@@ -0,0 +1,233 @@
+import heapq
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from vectordatabase import VectorDatabase
+
+def shard_of(vector_id, num_shards):
+    """Shard owning an id: a 64-bit mix of the id so consecutive ids spread evenly."""
+    h = (int(vector_id) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    h ^= h >> 31
+    return h % num_shards
+
+def _attach(name, shape, dtype):
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+def _worker(conn, shard, layout, db_params):
+    """Serve one shard: read vectors from shared memory, write top-k results back to it."""
+    db = VectorDatabase(**db_params)
+    handles = {name: _attach(*spec) for name, spec in layout.items()}
+    queries = handles["queries"][1]
+    staging = handles["staging"][1][shard]
+    out_ids = handles["ids"][1][shard]
+    out_distances = handles["distances"][1][shard]
+    try:
+        while True:
+            command, args = conn.recv()
+            try:
+                if command == "close":
+                    break
+                if command == "query":
+                    count, k, where, search_params = args
+                    ids, distances, metadata = db.query_batch(queries[:count], k, where=where, **search_params)
+                    found = ids.shape[1]
+                    out_ids[:count, :k] = -1
+                    out_distances[:count, :k] = np.inf
+                    out_ids[:count, :found] = ids
+                    out_distances[:count, :found] = distances
+                    conn.send(("ok", metadata))
+                elif command == "add":
+                    ids, metas = args
+                    db.add_vectors(staging[:len(ids)], metas, ids)
+                    conn.send(("ok", None))
+                elif command == "remove":
+                    db.remove_vector(args)
+                    conn.send(("ok", None))
+                elif command == "train":
+                    db.train()
+                    conn.send(("ok", None))
+                elif command == "len":
+                    conn.send(("ok", len(db)))
+                else:
+                    raise ValueError(f"Unknown command '{command}'.")
+            except Exception as exc:
+                conn.send(("error", exc))
+    finally:
+        for shm, _ in handles.values():
+            shm.close()
+
+class ShardedVectorDatabase:
+    """VectorDatabase split across worker processes, one shard per process.
+
+    Vectors cross process boundaries only through shared memory: queries are
+    written once into a buffer every shard reads, adds go through a per-shard
+    staging buffer, and each shard writes its top-k into a shared result
+    array. Only small control messages and metadata are pickled. Per-shard
+    results are merged with a heap.
+    """
+
+    def __init__(self, dim, num_shards=None, dtype=np.float64, max_batch=256, max_k=100, **db_params):
+        self.dim = dim
+        self.num_shards = num_shards or mp.cpu_count()
+        self.dtype = np.dtype(dtype)
+        # Vectors travel at the shards' compute precision; float16 and int8 are only a storage format
+        self.transfer_dtype = self.dtype if self.dtype.itemsize >= 4 else np.dtype(np.float32)
+        self.max_batch = max_batch
+        self.max_k = max_k
+        self.next_id = 0
+
+        shapes = {
+            "queries": ((max_batch, dim), self.transfer_dtype),
+            "staging": ((self.num_shards, max_batch, dim), self.transfer_dtype),
+            "ids": ((self.num_shards, max_batch, max_k), np.dtype(np.int64)),
+            "distances": ((self.num_shards, max_batch, max_k), np.dtype(np.float64)),
+        }
+        self._shm = {}
+        self._arrays = {}
+        layout = {}
+        for name, (shape, dt) in shapes.items():
+            shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dt.itemsize))
+            self._shm[name] = shm
+            self._arrays[name] = np.ndarray(shape, dtype=dt, buffer=shm.buf)
+            layout[name] = (shm.name, shape, dt)
+
+        db_params = dict(db_params, dim=dim, dtype=dtype)
+        self._conns = []
+        self._processes = []
+        for shard in range(self.num_shards):
+            parent, child = mp.Pipe()
+            process = mp.Process(target=_worker, args=(child, shard, layout, db_params), daemon=True)
+            process.start()
+            self._conns.append(parent)
+            self._processes.append(process)
+
+    def _recv(self, shard):
+        status, value = self._conns[shard].recv()
+        if status == "error":
+            raise value
+        return value
+
+    def _broadcast(self, command, args=None):
+        for conn in self._conns:
+            conn.send((command, args))
+        return [self._recv(shard) for shard in range(self.num_shards)]
+
+    def add_vectors(self, vectors, metadata=None):
+        """Add the rows of a matrix; each is routed to a shard by the hash of its id. Returns the ids."""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=self.transfer_dtype))
+        metadata = [None] * len(vectors) if metadata is None else list(metadata)
+        ids = np.arange(self.next_id, self.next_id + len(vectors))
+        self.next_id += len(vectors)
+        shards = np.array([shard_of(vector_id, self.num_shards) for vector_id in ids])
+
+        staging = self._arrays["staging"]
+        for start in range(0, len(vectors), self.max_batch):
+            stop = start + self.max_batch
+            busy = []
+            for shard in range(self.num_shards):
+                rows = np.flatnonzero(shards[start:stop] == shard) + start
+                if len(rows) == 0:
+                    continue
+                staging[shard, :len(rows)] = vectors[rows]
+                self._conns[shard].send(("add", (ids[rows].tolist(), [metadata[i] for i in rows])))
+                busy.append(shard)
+            for shard in busy:
+                self._recv(shard)
+        return ids
+
+    def add_vector(self, vector, meta=None):
+        """Add one vector and return its id."""
+        return int(self.add_vectors([vector], [meta])[0])
+
+    def remove_vector(self, vector_id):
+        """Remove a vector by id from the shard that owns it."""
+        shard = shard_of(vector_id, self.num_shards)
+        self._conns[shard].send(("remove", vector_id))
+        self._recv(shard)
+
+    def train(self):
+        """Train every shard's index on its own vectors."""
+        self._broadcast("train")
+
+    def query_batch(self, queries, k=1, where=None, **search_params):
+        """Fan a query batch out to every shard and merge the per-shard top-k.
+
+        Returns (ids, distances, metadata) like VectorDatabase.query_batch.
+        """
+        if k > self.max_k:
+            raise ValueError(f"k={k} is larger than max_k={self.max_k}.")
+        queries = np.atleast_2d(np.asarray(queries, dtype=self.transfer_dtype))
+        all_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        all_distances = np.full((len(queries), k), np.inf)
+        all_metadata = []
+
+        for start in range(0, len(queries), self.max_batch):
+            chunk = queries[start:start + self.max_batch]
+            count = len(chunk)
+            self._arrays["queries"][:count] = chunk
+            shard_metadata = self._broadcast("query", (count, k, where, search_params))
+            out_ids = self._arrays["ids"]
+            out_distances = self._arrays["distances"]
+            for i in range(count):
+                # Each shard's list is already sorted, so a heap merge yields the global order
+                streams = [
+                    zip(out_distances[s, i, :k].tolist(), out_ids[s, i, :k].tolist(), shard_metadata[s][i])
+                    for s in range(self.num_shards)
+                ]
+                merged = [hit for hit in heapq.merge(*streams) if hit[1] >= 0][:k]
+                row = start + i
+                all_ids[row, :len(merged)] = [vector_id for _, vector_id, _ in merged]
+                all_distances[row, :len(merged)] = [distance for distance, _, _ in merged]
+                all_metadata.append([meta for _, _, meta in merged])
+        return all_ids, all_distances, all_metadata
+
+    def query(self, vector, k=1, where=None, **search_params):
+        """Ids, metadata and distances of the k nearest neighbors of one vector."""
+        ids, distances, metadata = self.query_batch([vector], k, where=where, **search_params)
+        found = len(metadata[0])
+        return ids[0, :found], metadata[0], distances[0, :found]
+
+    def __len__(self):
+        return sum(self._broadcast("len"))
+
+    def close(self):
+        """Stop the workers and release the shared memory."""
+        if not self._conns:
+            return
+        for conn, process in zip(self._conns, self._processes):
+            conn.send(("close", None))
+            process.join()
+        self._conns, self._processes = [], []
+        for shm in self._shm.values():
+            shm.close()
+            shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Example usage
+if __name__ == "__main__":
+    import time
+
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(200000, 64)).astype(np.float32)
+    queries = rng.normal(size=(512, 64)).astype(np.float32)
+
+    single = VectorDatabase(dim=64, dtype=np.float32)
+    for i, vector in enumerate(data):
+        single.add_vector(vector, meta=i)
+    start = time.perf_counter()
+    expected, _, _ = single.query_batch(queries, k=10)
+    print(f"1 process: {len(queries) / (time.perf_counter() - start):.0f} QPS")
+
+    for num_shards in (2, 4):
+        with ShardedVectorDatabase(dim=64, num_shards=num_shards, dtype=np.float32) as sharded:
+            sharded.add_vectors(data, metadata=range(len(data)))
+            start = time.perf_counter()
+            ids, _, _ = sharded.query_batch(queries, k=10)
+            elapsed = time.perf_counter() - start
+            print(f"{num_shards} shards: {len(queries) / elapsed:.0f} QPS, same results: {(ids == expected).all()}")
@@ -0,0 +1,557 @@
+import mmap
+import os
+import numpy as np
+from distances import METRICS
+
+# Row-aligned columns and the .npy file each one is saved to
+COLUMN_FILES = {
+    "vectors": "vectors.npy",  # In the storage dtype; int8 rows hold codes, see calibrate()
+    "sq_norms": "sq_norms.npy",  # Cached squared norms, used by the distance kernel
+    "ids": "ids.npy",  # Stable external id of each row, increasing with the row number
+    "alive": "alive.npy",  # False once a row is tombstoned
+    "originals": "originals.npy",  # Full-precision copy for re-ranking, only with keep_originals
+}
+
+def column_file(name, generation):
+    """File of a column written by the rewrite numbered generation; 0 is the plain name.
+
+    A rewrite (a full save or the compaction of memory-mapped columns) never
+    overwrites the files the saved header names, so a crash before the new
+    header is saved leaves the previous snapshot readable.
+    """
+    if generation == 0:
+        return COLUMN_FILES[name]
+    return COLUMN_FILES[name].replace(".npy", f".{generation}.npy")
+
+def is_column_file(name):
+    """Whether a file name is one column_file() gives."""
+    return name.endswith(".npy") and name.split(".")[0] in COLUMN_FILES
+
+# Storage precisions; float16 and int8 rows are widened to float32 a block at a time by the kernels
+PRECISIONS = ("float64", "float32", "float16", "int8")
+BLOCK_ROWS = 65536
+# Unit of change tracking between snapshots
+SEGMENT_ROWS = 4096
+
+class VectorStorage:
+    """Contiguous, preallocated matrix of vectors that grows geometrically.
+
+    With a path, the columns are memory-mapped files in that directory from
+    the start, so the vectors take page cache rather than process memory.
+    """
+
+    def __init__(
+        self, dim=None, dtype=np.float64, capacity=1024, growth=2.0, metric="l2",
+        keep_originals=False, calibration_rows=1024, path=None
+    ):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}', expected one of {METRICS}.")
+        self.dtype = np.dtype(dtype)
+        if self.dtype.name not in PRECISIONS:
+            raise ValueError(f"Unsupported dtype '{self.dtype}', expected one of {PRECISIONS}.")
+        # Precision of queries, norms and kernel arithmetic
+        self.compute_dtype = self.dtype if self.dtype.itemsize >= 4 else np.dtype(np.float32)
+        self.dim = dim
+        self.metric = metric
+        self.growth = growth
+        self.keep_originals = keep_originals
+        # int8 only: vector ~= offset + scale * code per dimension, fitted on the first calibration_rows vectors
+        self.calibration_rows = calibration_rows
+        self.scale = None
+        self.offset = None
+        self._pending = []  # (first row, matrix) blocks of int8 rows added before calibration
+        self._pending_rows = 0
+        self._size = 0
+        self._capacity = max(1, capacity)
+        self._columns = {}
+        self.live_count = 0
+        self.path = path  # Directory of the backing .npy files when memory-mapped
+        self.files = {}  # Column name -> file backing it in that directory
+        self.readonly = False
+        self._generation = 0  # Number of the last rewrite, part of the names of the files it wrote
+        # Directory, row count and column files of the last save(); saving there again only writes what changed
+        self._saved = None
+        self._tombstoned = set()  # Segments with rows deleted since that save
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+        if dim is not None:
+            self._allocate(dim)
+
+    def header(self):
+        """Settings saved next to the column files, needed to reopen them."""
+        self.calibrate()
+        return {
+            "size": self._size,
+            "files": dict(self._saved[2]) if self._saved else {},
+            "generation": self._generation,
+            "metric": self.metric,
+            "keep_originals": self.keep_originals,
+            "calibration_rows": self.calibration_rows,
+            "scale": self.scale,
+            "offset": self.offset,
+        }
+
+    @classmethod
+    def open(cls, path, mode="r", header=None):
+        """Memory-map the buffers saved in a directory; nothing is read until it is touched.
+
+        header is the dict returned by header() when the storage was saved.
+        """
+        if mode not in ("r", "r+"):
+            raise ValueError("mode must be 'r' or 'r+'.")
+        header = header or {}
+        keep_originals = header.get("keep_originals", False)
+        files = header.get("files") or {
+            name: file for name, file in COLUMN_FILES.items() if name != "originals" or keep_originals
+        }
+        columns = {name: np.load(os.path.join(path, file), mmap_mode=mode) for name, file in files.items()}
+        storage = cls(
+            dtype=columns["vectors"].dtype, capacity=len(columns["vectors"]), metric=header.get("metric", "l2"),
+            keep_originals=keep_originals, calibration_rows=header.get("calibration_rows", 1024)
+        )
+        storage.dim = columns["vectors"].shape[1]
+        storage.scale, storage.offset = header.get("scale"), header.get("offset")
+        storage._columns = columns
+        storage._size = header.get("size", len(columns["vectors"]))
+        storage.live_count = int(storage.alive.sum())
+        storage.path = path
+        storage.files = dict(files)
+        storage.readonly = mode == "r"
+        storage._generation = header.get("generation", 0)
+        storage._saved = (path, storage._size, dict(files))
+        return storage
+
+    def save(self, path):
+        """Write the occupied rows to .npy files in a directory.
+
+        Saving again to the same directory only writes the rows appended and
+        the tombstones set since, as long as the files have room for them; the
+        files are allocated with the spare capacity of the buffers for that.
+        Otherwise every column goes to a new file (see column_file()); the
+        files in use are the ones header() names afterwards, and the old ones
+        are left for the caller to remove once that header is saved.
+        """
+        self.calibrate()
+        os.makedirs(path, exist_ok=True)
+        if path == self.path and self._columns:
+            self.flush()
+            files = dict(self.files)
+        elif self._write_changes(path):
+            files = self._saved[2]
+        else:
+            self._generation += 1
+            files = {name: column_file(name, self._generation) for name in self._column_names()}
+            for name, file in files.items():
+                if not self._columns:
+                    np.save(os.path.join(path, file), self._column(name))
+                    continue
+                shape, dtype = self._spec(name)
+                out = np.lib.format.open_memmap(
+                    os.path.join(path, file), mode="w+", dtype=dtype, shape=(self._capacity,) + shape
+                )
+                out[:self._size] = self._column(name)
+                out.flush()
+                del out
+        self._saved = (path, self._size, files)
+        self._tombstoned = set()
+
+    def _write_changes(self, path):
+        """Patch the files of the last save in place; False when they need a full rewrite."""
+        if self._saved is None or self._saved[0] != path:
+            return False
+        files = {}
+        for name in self._column_names():
+            file = os.path.join(path, self._saved[2][name])
+            if not os.path.exists(file):
+                return False
+            files[name] = np.load(file, mmap_mode="r+")
+            if len(files[name]) < self._size:
+                return False
+        start = self._saved[1]
+        for name, out in files.items():
+            column = self._column(name)
+            out[start:self._size] = column[start:]
+            if name == "alive":
+                for segment in self._tombstoned:
+                    rows = slice(segment * SEGMENT_ROWS, min((segment + 1) * SEGMENT_ROWS, start))
+                    out[rows] = column[rows]
+            out.flush()
+        return True
+
+    def flush(self):
+        """Push pending writes of a memory-mapped buffer to disk."""
+        for buffer in self._columns.values():
+            if isinstance(buffer, np.memmap):
+                buffer.flush()
+
+    def release(self):
+        """Flush memory-mapped buffers and drop their pages from this process's resident memory.
+
+        The pages stay in the page cache and are mapped again when touched, so
+        a file-backed storage only keeps resident what searches keep reading.
+        Happens by itself every SEGMENT_ROWS appended rows.
+        """
+        self.flush()
+        if not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        for buffer in self._columns.values():
+            if isinstance(buffer, np.memmap):
+                buffer._mmap.madvise(mmap.MADV_DONTNEED)
+
+    def _column_names(self):
+        return [name for name in COLUMN_FILES if name != "originals" or self.keep_originals]
+
+    def _spec(self, name):
+        """Shape of one row and dtype of a column."""
+        if name == "vectors":
+            return (self.dim,), self.dtype
+        if name == "originals":
+            return (self.dim,), np.dtype(np.float32) if self.dtype.itemsize < 4 else self.dtype
+        if name == "sq_norms":
+            return (), self.compute_dtype
+        if name == "ids":
+            return (), np.dtype(np.int64)
+        return (), np.dtype(bool)
+
+    def _empty(self, name, capacity):
+        shape, dtype = self._spec(name)
+        if self.path is None:
+            return np.empty((capacity,) + shape, dtype=dtype)
+        file = os.path.join(self.path, column_file(name, self._generation))
+        return np.lib.format.open_memmap(file, mode="w+", dtype=dtype, shape=(capacity,) + shape)
+
+    def _allocate(self, dim):
+        self.dim = dim
+        self._columns = {name: self._empty(name, self._capacity) for name in self._column_names()}
+        if self.path is not None:
+            self.files = {name: column_file(name, self._generation) for name in self._columns}
+
+    def _grow(self, min_capacity):
+        """Reallocate the buffer to at least min_capacity rows."""
+        capacity = self._capacity
+        while capacity < min_capacity:
+            capacity = int(capacity * self.growth) + 1
+        self._reallocate(capacity, slice(None))
+
+    def _reallocate(self, capacity, rows):
+        """Copy the given occupied rows to the top of new buffers of that capacity.
+
+        File-backed columns move to files of a new generation (see column_file()).
+        """
+        if self.path is not None:
+            self._generation += 1
+        for name, old in self._columns.items():
+            new = self._empty(name, capacity)
+            kept = old[:self._size][rows]
+            new[:len(kept)] = kept
+            self._columns[name] = new
+        self._capacity = capacity
+        if self.path is not None:
+            # The replaced files can go unless the last save in this directory named them
+            saved = self._saved[2].values() if self._saved and self._saved[0] == self.path else ()
+            for file in set(self.files.values()) - set(saved):
+                os.remove(os.path.join(self.path, file))
+            self.files = {name: column_file(name, self._generation) for name in self._columns}
+
+    def _check_writable(self):
+        if self.readonly:
+            raise ValueError("Storage is opened read-only.")
+
+    def append(self, vector, vector_id):
+        """Copy a vector into the next free row and return its row number."""
+        self._check_writable()
+        vector = self.prepare(vector).ravel()
+        if not self._columns:
+            self._allocate(vector.shape[0])
+        elif vector.shape[0] != self.dim:
+            raise ValueError(f"Expected a vector of dimension {self.dim}, got {vector.shape[0]}.")
+        if self._size and vector_id <= self._columns["ids"][self._size - 1]:
+            raise ValueError("Vector ids must be increasing.")
+        if self._size == self._capacity:
+            self._grow(self._size + 1)
+
+        row = self._size
+        self._columns["ids"][row] = vector_id
+        self._columns["alive"][row] = True
+        if self.keep_originals:
+            self._columns["originals"][row] = vector
+        self._size += 1
+        self.live_count += 1
+        self._store(row, vector)
+        self._appended(row)
+        return row
+
+    def extend(self, vectors, ids):
+        """Copy the rows of a matrix into the next free rows in one pass; returns the slice of rows used.
+
+        The buffer grows at most once, and the columns are written with one
+        vectorized assignment each, so the cost per row is a memory copy.
+        """
+        self._check_writable()
+        vectors = self.prepare(np.atleast_2d(vectors))
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) != len(vectors):
+            raise ValueError("Expected one id per vector.")
+        if not self._columns:
+            self._allocate(vectors.shape[1])
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of dimension {self.dim}, got {vectors.shape[1]}.")
+        start = self._size
+        if len(ids) == 0:
+            return slice(start, start)
+        if (np.diff(ids) <= 0).any() or (start and ids[0] <= self._columns["ids"][start - 1]):
+            raise ValueError("Vector ids must be increasing.")
+        self.reserve(len(ids))
+
+        rows = slice(start, start + len(ids))
+        self._columns["ids"][rows] = ids
+        self._columns["alive"][rows] = True
+        if self.keep_originals:
+            self._columns["originals"][rows] = vectors
+        self._size += len(ids)
+        self.live_count += len(ids)
+        self._store(rows, vectors)
+        self._appended(start)
+        return rows
+
+    def _appended(self, start):
+        """Release file-backed pages whenever appends from row start crossed a segment boundary."""
+        if self.path is not None and start // SEGMENT_ROWS != self._size // SEGMENT_ROWS:
+            self.release()
+
+    def reserve(self, rows):
+        """Make room for that many more rows, so later appends do not reallocate."""
+        if self._size + rows > self._capacity:
+            self._grow(self._size + rows)
+
+    def _store(self, rows, vectors):
+        """Write prepared vectors, or hold them back until int8 storage is calibrated."""
+        if self.dtype.kind == "i" and self.scale is None:
+            block = np.array(vectors, ndmin=2)
+            self._pending.append((rows if isinstance(rows, int) else rows.start, block))
+            self._pending_rows += len(block)
+            if self._pending_rows >= self.calibration_rows:
+                self.calibrate()
+        else:
+            self._write(rows, vectors)
+
+    def _write(self, rows, vectors):
+        """Store vectors in the storage dtype and cache the norms of what was actually stored."""
+        if self.dtype.kind == "i":
+            codes = np.rint((vectors - self.offset) / self.scale)
+            self._columns["vectors"][rows] = np.clip(codes, -127, 127)
+        else:
+            self._columns["vectors"][rows] = vectors
+        stored = self._decode(self._columns["vectors"][rows])
+        self._columns["sq_norms"][rows] = (stored * stored).sum(axis=-1)
+
+    @property
+    def calibrated(self):
+        """False while int8 rows wait for their scale and offset."""
+        return not self._pending
+
+    def calibrate(self):
+        """Fit the int8 per-dimension scale and offset to the rows added so far and encode them.
+
+        Happens by itself once calibration_rows vectors were added, or on the
+        first read before that. Later values outside the fitted range are clipped.
+        """
+        if not self._pending:
+            return
+        rows = np.concatenate([np.arange(first, first + len(block)) for first, block in self._pending])
+        vectors = np.concatenate([block for _, block in self._pending])
+        low, high = vectors.min(axis=0), vectors.max(axis=0)
+        self.offset = ((high + low) / 2).astype(self.compute_dtype)
+        self.scale = np.maximum((high - low) / 254, np.finfo(np.float32).eps).astype(self.compute_dtype)
+        self._pending, self._pending_rows = [], 0
+        self._write(rows, vectors)
+
+    def _decode(self, stored):
+        """Stored rows at compute precision."""
+        if self.dtype.kind == "i":
+            return self.offset + self.scale * stored
+        return stored.astype(self.compute_dtype, copy=False)
+
+    def row_of(self, vector_id):
+        """Row holding a live vector id, found by binary search over the sorted ids."""
+        ids = self.ids
+        row = int(np.searchsorted(ids, vector_id))
+        if row == len(ids) or ids[row] != vector_id or not self.alive[row]:
+            raise IndexError(f"No vector with id {vector_id}.")
+        return row
+
+    def delete(self, row):
+        """Tombstone a row in O(1); searches skip it until compact()."""
+        self._check_writable()
+        self._columns["alive"][row] = False
+        self._tombstoned.add(row // SEGMENT_ROWS)
+        self.live_count -= 1
+
+    def compact(self):
+        """Drop tombstoned rows, keeping the order of the live ones.
+
+        Returns the boolean mask of kept rows, in the old row numbering.
+        """
+        self._check_writable()
+        self.calibrate()
+        keep = self.alive.copy()
+        if self.path is None:
+            for name, column in self._columns.items():
+                column[:self.live_count] = column[:self._size][keep]
+        else:
+            # The mapped files may be the last snapshot's; the live rows go to new ones
+            self._reallocate(self._capacity, keep)
+        self._size = self.live_count
+        self._saved = None  # Every row may have moved
+        return keep
+
+    def _column(self, name):
+        if not self._columns:
+            return np.empty((0, 0) if name in ("vectors", "originals") else 0, dtype=self._spec(name)[1])
+        return self._columns[name][:self._size]
+
+    @property
+    def data(self):
+        """View of the occupied rows in the storage dtype (no copy), tombstoned ones included."""
+        return self._column("vectors")
+
+    @property
+    def sq_norms(self):
+        return self._column("sq_norms")
+
+    @property
+    def ids(self):
+        return self._column("ids")
+
+    @property
+    def alive(self):
+        return self._column("alive")
+
+    def get(self, rows=slice(None)):
+        """Stored vectors at compute precision; a view for float32 and float64 storage."""
+        self.calibrate()
+        return self._decode(self.data[rows])
+
+    def get_exact(self, rows=slice(None)):
+        """Full-precision originals of the given rows, or the stored vectors without keep_originals."""
+        if not self.keep_originals:
+            return self.get(rows)
+        return self._column("originals")[rows]
+
+    def bytes_per_vector(self):
+        """Bytes one row takes in the vector and norm columns the kernels scan, plus the
+        full-precision copy with keep_originals (read only when re-ranking)."""
+        total = self.dim * self.dtype.itemsize + self.compute_dtype.itemsize
+        if self.keep_originals:
+            _, dtype = self._spec("originals")
+            total += self.dim * dtype.itemsize
+        return total
+
+    def prepare(self, vectors):
+        """Cast vectors to the compute dtype, normalizing them for the cosine metric.
+
+        Stored vectors are prepared once at insert time; queries must be prepared
+        before they are passed to distances().
+        """
+        vectors = np.asarray(vectors, dtype=self.compute_dtype)
+        if self.metric == "cosine":
+            norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+        return vectors
+
+    def _dots(self, queries, rows=None):
+        """Inner products of prepared queries with the stored rows, shape (n_queries, n_rows)."""
+        self.calibrate()
+        data = self.data if rows is None else self.data[rows]
+        if self.dtype == self.compute_dtype:
+            # One matrix product (BLAS gemv/gemm) straight on the buffer
+            return queries @ data.T
+        dots = np.empty((len(queries), len(data)), dtype=self.compute_dtype)
+        if len(data) == 0:
+            return dots
+        base = 0.0
+        if self.dtype.kind == "i":
+            # q.x = q.offset + (q * scale).code, so rows are only ever read as codes
+            base = (queries @ self.offset)[:, None]
+            queries = queries * self.scale
+        for start in range(0, len(data), BLOCK_ROWS):
+            block = data[start:start + BLOCK_ROWS].astype(self.compute_dtype)
+            np.matmul(queries, block.T, out=dots[:, start:start + BLOCK_ROWS])
+        dots += base
+        return dots
+
+    def _finish(self, dots, queries, sq_norms):
+        """Turn inner products into distances for the metric, in place."""
+        if self.metric == "cosine":
+            return np.subtract(1.0, dots, out=dots)
+        if self.metric == "ip":
+            return np.negative(dots, out=dots)
+        # ||x - q||^2 = ||x||^2 - 2 x.q + ||q||^2, using the cached norms
+        dots *= -2.0
+        dots += sq_norms[None, :]
+        dots += (queries * queries).sum(axis=1)[:, None]
+        return np.maximum(dots, 0.0, out=dots)
+
+    def distances(self, vector, rows=None):
+        """Distances from a prepared vector to every stored row, or only to the given rows.
+
+        Smaller is closer: squared euclidean distance for l2, 1 - cosine
+        similarity for cosine and the negated inner product for ip. Compact
+        dtypes are scored as stored, without decoding whole rows.
+        """
+        queries = np.atleast_2d(vector)
+        sq_norms = self.sq_norms if rows is None else self.sq_norms[rows]
+        return self._finish(self._dots(queries, rows), queries, sq_norms)[0]
+
+    def scorer(self, vector):
+        """Function giving the distances from one prepared vector to the rows it is passed.
+
+        Computes what distances(vector, rows) does with the per-call work done
+        once up front (query cast, int8 offset, query norm), so walks that score
+        a handful of rows per step, such as graph searches, mostly pay for the
+        rows themselves. The function reads the buffer as it is now; rows added
+        after it was made are not seen if the buffer grows.
+        """
+        self.calibrate()
+        query = np.asarray(vector, dtype=self.compute_dtype).ravel()
+        data, sq_norms = self.data, self.sq_norms
+        base = 0.0
+        if self.dtype.kind == "i":
+            # As in _dots: q.x = q.offset + (q * scale).code
+            base = float(query @ self.offset)
+            scaled = query * self.scale
+        else:
+            scaled = query
+        if self.metric == "cosine":
+            return lambda rows: (1.0 - base) - data[rows] @ scaled
+        if self.metric == "ip":
+            return lambda rows: -base - data[rows] @ scaled
+        norm = float(query @ query)
+
+        def score(rows):
+            dists = data[rows] @ scaled
+            dists *= -2.0
+            dists += sq_norms[rows]
+            dists += norm - 2.0 * base
+            return np.maximum(dists, 0.0, out=dists)
+
+        return score
+
+    def distances_batch(self, queries):
+        """Distances from each prepared query (rows of a matrix) to every stored row."""
+        queries = np.atleast_2d(queries)
+        return self._finish(self._dots(queries), queries, self.sq_norms)
+
+    def exact_distances(self, vector, rows):
+        """Distances to the full-precision originals of some rows, or to the stored rows without keep_originals."""
+        if not self.keep_originals:
+            return self.distances(vector, rows)
+        originals = self.get_exact(rows)
+        queries = np.atleast_2d(vector).astype(originals.dtype)
+        return self._finish(queries @ originals.T, queries, (originals * originals).sum(axis=1))[0]
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, row):
+        return self.get(row)
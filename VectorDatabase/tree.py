@@ -0,0 +1,106 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from distances import top_k
+
+class TreeIndex:
+    """Exact k-d tree over the rows of a VectorStorage, for low-dimensional collections.
+
+    The tree is static: rows added after a build go to a delta buffer that is
+    scanned by brute force, and the tree is rebuilt over every row once the
+    delta outgrows rebuild_ratio of it (and min_delta rows). Cosine works on
+    the unit vectors because 1 - cos = |a - b|^2 / 2 there; the inner product
+    is not a metric, so it has no tree.
+    """
+
+    requires_training = False
+
+    def __init__(self, storage, leafsize=16, rebuild_ratio=0.1, min_delta=1024):
+        if storage.metric == "ip":
+            raise ValueError("A tree index needs the l2 or cosine metric.")
+        self.storage = storage
+        self.leafsize = leafsize
+        self.rebuild_ratio = rebuild_ratio
+        self.min_delta = min_delta
+        self.reset()
+
+    def __getstate__(self):
+        # The storage is saved separately and re-attached on load; the tree is rebuilt on first use
+        state = self.__dict__.copy()
+        state["storage"] = None
+        state["_tree"] = None
+        return state
+
+    def reset(self):
+        """Drop the tree and the delta buffer."""
+        self._tree = None
+        self._tree_size = 0  # The tree holds rows [0, _tree_size), the delta buffer the rest
+        self._size = 0
+
+    def add(self, rows, vectors):
+        """Put rows in the delta buffer, rebuilding the tree when it gets too big; rows come in storage order."""
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        if len(rows) and rows[0] != self._size:
+            raise ValueError("Tree rows must be added in storage row order.")
+        self._size += len(rows)
+        if self._size - self._tree_size > max(self.min_delta, self.rebuild_ratio * self._tree_size):
+            self.build()
+
+    def compact(self, keep):
+        """Follow a storage compaction: the tree is rebuilt over the surviving rows on next use."""
+        self._tree_size = int(keep[:self._tree_size].sum())
+        self._size = int(keep[:self._size].sum())
+        self._tree = None
+
+    def build(self):
+        """Rebuild the tree over every row, merging the delta buffer into it."""
+        self._tree_size = self._size
+        self._tree = cKDTree(self.storage.get(slice(0, self._size)), leafsize=self.leafsize) if self._size else None
+
+    def _ensure_tree(self):
+        if self._tree is None and self._tree_size:
+            self._tree = cKDTree(self.storage.get(slice(0, self._tree_size)), leafsize=self.leafsize)
+
+    def _delta(self):
+        rows = np.arange(self._tree_size, self._size)
+        return rows[self.storage.alive[rows]]
+
+    def _rescore(self, vector, rows, k):
+        # Tree distances are euclidean; rescoring gives the same distances as every other search path
+        distances = self.storage.distances(vector, rows)
+        order = top_k(distances, k)
+        return rows[order], distances[order]
+
+    def search(self, vector, k):
+        """Exact k nearest rows and their distances."""
+        self._ensure_tree()
+        found = [self._delta()]
+        if self._tree is not None:
+            # Tombstoned rows stay in the tree until a rebuild, so fetch more until k live ones turn up
+            fetch = k
+            while True:
+                _, rows = self._tree.query(vector, min(fetch, self._tree_size))
+                rows = np.atleast_1d(rows)
+                live = rows[self.storage.alive[rows]]
+                if len(live) >= k or fetch >= self._tree_size:
+                    break
+                fetch *= 2
+            found.append(live)
+        return self._rescore(vector, np.concatenate(found), k)
+
+    def radius(self, vector, limit):
+        """Rows within a raw metric distance (squared for l2) of the vector, nearest first."""
+        self._ensure_tree()
+        found = [self._delta()]
+        if self._tree is not None:
+            reach = np.sqrt(limit) if self.storage.metric == "l2" else np.sqrt(2 * limit)
+            rows = np.asarray(self._tree.query_ball_point(vector, reach), dtype=np.int64)
+            found.append(rows[self.storage.alive[rows]])
+        rows = np.concatenate(found)
+        distances = self.storage.distances(vector, rows)
+        inside = distances <= limit
+        rows, distances = rows[inside], distances[inside]
+        order = np.argsort(distances)
+        return rows[order], distances[order]
+
+    def __len__(self):
+        return self._size
@@ -1,44 +1,651 @@
+import itertools
+import os
+import pickle
+import time
+import zipfile
 import numpy as np
-from scipy.spatial import distance
+from storage import VectorStorage, SEGMENT_ROWS, is_column_file
+from wal import WriteAheadLog
+from distances import top_k
+from filters import MetadataIndex
+from cache import QueryCache
+from ivf import IVFIndex
+from hnsw import HNSWIndex
+from pq import PQIndex
+from lsh import LSHIndex
+from tree import TreeIndex
+
+# Indexes selectable at construction; None means exhaustive search and "auto"
+# picks the exact tree for l2 and cosine collections of at most TREE_MAX_DIM dimensions,
+# below which it beats a scan even on uniform data (the worst case for a tree)
+INDEXES = {
+    "ivf": IVFIndex,
+    "hnsw": HNSWIndex,
+    "pq": PQIndex,
+    "lsh": LSHIndex,
+    "tree": TreeIndex,
+}
+TREE_MAX_DIM = 12
+
+# Files next to the vector columns of a saved database
+SIDECAR_FILE = "metadata.pkl"  # Settings and the layout of the files below, replaced last on save
+# Metadata of SEGMENT_ROWS consecutive rows, and the index, under the number of the save that
+# wrote them (rewritten vector columns get numbered names too, see storage.column_file): a save
+# never overwrites a file the current sidecar names, so a crash before the sidecar is replaced
+# leaves the previous snapshot whole
+SEGMENT_FILE = "segment-{:05d}.{:d}.pkl"
+INDEX_FILE = "index.{:d}.pkl"
+WAL_FILE = "wal.log"
+# Share of rows missing from the saved index above which a snapshot pickles the index again;
+# below it, open() inserts the missing rows instead
+INDEX_LAG = 0.1
 
 class VectorDatabase:
-    def __init__(self):
-        self.vectors = []
+    def __init__(
+        self, dim=None, dtype=np.float64, capacity=1024, index="auto", metric="l2",
+        compact_threshold=0.25, prefilter_threshold=0.1, keep_originals=False, cache_size=0, cache_ttl=None,
+        path=None, **index_params
+    ):
+        # metric is "l2", "cosine" (vectors are normalized on insert) or "ip" (inner product)
+        # dtype is the storage precision: float64, float32, float16 or int8 (scaled per dimension);
+        # keep_originals also stores float32 copies so query(refine=n) can re-rank exactly
+        # path keeps the vectors in memory-mapped files in that directory instead of in RAM, where
+        # save() without a path snapshots them; with index="pq" only the codes need to stay resident
+        self.storage = VectorStorage(
+            dim, dtype=dtype, capacity=capacity, metric=metric, keep_originals=keep_originals, path=path
+        )
         self.metadata = []  # Optional: to store additional data related to vectors
+        self.filters = MetadataIndex()  # Lets query(where=...) find matching rows without a scan
+        # Filtered index queries scan the matching rows exactly when at most this share of rows match
+        self.prefilter_threshold = prefilter_threshold
+        self.next_id = 0
+        self.compact_threshold = compact_threshold  # Fraction of tombstoned rows that triggers compact()
+        # Opt-in LRU cache of search results, at most cache_size entries each living cache_ttl seconds
+        self.cache = QueryCache(cache_size, cache_ttl) if cache_size else None
+        self.index_name = index
+        self.index = None
+        self._index_params = index_params
+        if index == "auto":
+            self._choose_index()
+        elif index is not None:
+            if index not in INDEXES:
+                raise ValueError(f"Unknown index '{index}', expected one of {sorted(INDEXES)}.")
+            self.index = INDEXES[index](self.storage, **index_params)
+        self.wal = None  # Write-ahead log, kept by databases opened with mode='r+'
+        self.snapshot_every = None  # Logged operations after which save() runs by itself
+        self._snapshot_path = None  # Directory of the last save; saving there again only writes changes
+        self._dirty = set()  # Metadata segments changed since then
+        self._generation = 0  # Number of the last save, part of the names of the files it wrote
+        self._segment_files = []  # File of each metadata segment in the last save
+        self._index_file = None
+        self._indexed_rows = 0  # Rows covered by the index file of the last save
+        self._index_dirty = True
+
+    def _choose_index(self):
+        """Resolve index="auto" once the dimension is known (at the first add when not given)."""
+        if self.storage.dim is None:
+            return
+        if self.storage.dim <= TREE_MAX_DIM and self.metric != "ip":
+            self.index_name = "tree"
+            self.index = TreeIndex(self.storage, **self._index_params)
+        else:
+            self.index_name = None
+
+    @property
+    def vectors(self):
+        """The stored vectors as one contiguous matrix (tombstoned rows included until compact()).
 
-    def add_vector(self, vector, meta=None):
-        """Add a new vector to the database."""
-        if not isinstance(vector, np.ndarray):
-            vector = np.array(vector)
-        self.vectors.append(vector)
+        A view for float32 and float64 storage, a decoded copy for the compact dtypes.
+        """
+        return self.storage.get()
+
+    def add_vector(self, vector, meta=None, vector_id=None):
+        """Add a new vector to the database and return its id.
+
+        Ids are assigned in increasing order unless given explicitly, in which
+        case they must still be larger than every id already stored.
+        """
+        if vector_id is None:
+            vector_id = self.next_id
+        row = self.storage.append(vector, vector_id)
+        if self.index_name == "auto":
+            self._choose_index()
+        self.next_id = vector_id + 1
         self.metadata.append(meta)
+        self.filters.add(row, meta)
+        self._dirty.add(row // SEGMENT_ROWS)
+        if self._index_ready():
+            if self.index.requires_training:
+                self.index.add(row, self.storage[row])
+            else:
+                self._catch_up()
+        if self.cache is not None and len(self.cache):
+            self.cache.added(self.storage.get([row]), self.storage.get_exact([row]), [meta], self.metric)
+        if self.wal is not None:
+            self.wal.log_add(vector_id, vector, meta)
+            self._logged()
+        return vector_id
+
+    def add_vectors(self, vectors, metadata=None, ids=None):
+        """Add the rows of a matrix in one pass and return their ids.
+
+        The matrix (a memory-mapped array works too) is copied straight into
+        the storage buffer and handed to the index as one batch. metadata is
+        one entry per row; ids default to the next free ids.
+        """
+        vectors = np.asarray(vectors)
+        if vectors.size == 0:
+            # Checked before the promotion below, which would turn [] into one row of dimension 0
+            return np.empty(0, dtype=np.int64)
+        if vectors.ndim == 1:
+            vectors = vectors[None]
+        count = len(vectors)
+        ids = np.arange(self.next_id, self.next_id + count) if ids is None else np.asarray(ids, dtype=np.int64)
+        metadata = [None] * count if metadata is None else list(metadata)
+        if len(metadata) != count:
+            raise ValueError(f"Expected {count} metadata entries, got {len(metadata)}.")
+        rows = self.storage.extend(vectors, ids)
+        if self.index_name == "auto":
+            self._choose_index()
+        self.next_id = int(ids[-1]) + 1
+        self.metadata.extend(metadata)
+        for row, meta in zip(range(rows.start, rows.stop), metadata):
+            self.filters.add(row, meta)
+        self._dirty.update(range(rows.start // SEGMENT_ROWS, (rows.stop - 1) // SEGMENT_ROWS + 1))
+        if self._index_ready():
+            if self.index.requires_training:
+                self.index.add(np.arange(rows.start, rows.stop), self.storage.get(rows))
+            else:
+                self._catch_up()
+        if self.cache is not None and len(self.cache):
+            self.cache.added(self.storage.get(rows), self.storage.get_exact(rows), metadata, self.metric)
+        if self.wal is not None:
+            self.wal.log_add_many(ids, vectors, metadata)
+            self._logged()
+        return ids
+
+    def ingest(self, path, chunk_rows=65536, key=None, metadata=None, delimiter=",", skiprows=0):
+        """Stream a .npy, .npz or CSV file into the database in chunks of chunk_rows rows.
+
+        .npy files are memory-mapped and .npz members are decompressed as they
+        are read, so at most one chunk is held in memory besides the storage
+        itself. key selects the array of an .npz file (its first one by
+        default); CSV rows are parsed with delimiter after skipping skiprows
+        lines. metadata, if given, is one entry per row of the file.
+
+        Returns {"rows", "seconds", "rows_per_second"}.
+        """
+        start = time.perf_counter()
+        rows = 0
+        for chunk in _read_chunks(path, chunk_rows, key, delimiter, skiprows):
+            meta = None if metadata is None else metadata[rows:rows + len(chunk)]
+            self.add_vectors(chunk, meta)
+            rows += len(chunk)
+        seconds = time.perf_counter() - start
+        return {"rows": rows, "seconds": seconds, "rows_per_second": rows / seconds if seconds else float("inf")}
+
+    def _index_ready(self):
+        if self.index is None or not self.storage.calibrated:
+            return False
+        return not self.index.requires_training or self.index.trained
+
+    def _catch_up(self):
+        """Insert the rows a graph index (one without training) has not seen yet.
+
+        Normally only the newest row; int8 storage holds rows back until it has
+        calibrated, since their codes are not known before.
+        """
+        if self.index.requires_training:
+            return
+        start = len(self.index)
+        if start < len(self.storage):
+            self.index.add(np.arange(start, len(self.storage)), self.storage.get(slice(start, None)))
+
+    def train(self):
+        """Train the index on the stored vectors and index all of them."""
+        if self.index is None:
+            raise ValueError("This database has no index to train.")
+        if self.index.requires_training:
+            self.index.train(self.storage.get(self.storage.alive))
+        else:
+            self.index.reset()
+        self._index_all()
+        self.storage.release()  # A file-backed storage was read in full
+        if self.cache is not None:
+            self.cache.clear()
+
+    def _index_all(self):
+        # Every row goes in, tombstones too, so index positions stay aligned with storage rows
+        self.index.add(np.arange(len(self.storage)), self.storage.get())
+        self._index_dirty = True
+
+    def rebuild(self):
+        """Discard the index and build it again from the current contents."""
+        self.train()
 
-    def query(self, vector, k=1):
-        """Query the database for the k nearest neighbors to the input vector."""
-        if not isinstance(vector, np.ndarray):
-            vector = np.array(vector)
+    @property
+    def metric(self):
+        return self.storage.metric
+
+    def search(self, vector, k=1, exact=False, where=None, **search_params):
+        """Ids of the k nearest neighbors and their raw metric distances (squared for l2).
+
+        Uses the index when there is one (search_params such as nprobe or ef_search
+        are passed through to it); exact=True forces a brute-force scan. where
+        restricts the search to vectors whose metadata dict matches every field.
+        refine=n re-scores the best n candidates against the full-precision
+        vectors kept with keep_originals=True.
+        """
+        rows, distances = self._search_rows(vector, k, exact, where, **search_params)
+        return self.storage.ids[rows], distances
+
+    def _match(self, where):
+        """Bitmap of the live rows matching a where-clause, and how many there are."""
+        mask = self.filters.match(where, len(self.storage))
+        mask &= self.storage.alive
+        return mask, int(np.count_nonzero(mask))
+
+    def _search_rows(self, vector, k, exact=False, where=None, refine=0, **search_params):
+        if self.storage.live_count == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        vector = self.storage.prepare(vector).ravel()
+        if self.cache is None:
+            return self._ranked_rows(vector, k, exact, where, refine, **search_params)
+        key = self.cache.key(vector, k, exact, where, refine, search_params)
+        found = self.cache.get(key)
+        if found is None:
+            found = self._ranked_rows(vector, k, exact, where, refine, **search_params)
+            self.cache.put(key, vector, k, where, *found)
+        return found
+
+    def _ranked_rows(self, vector, k, exact, where, refine, **search_params):
+        if not refine:
+            return self._candidate_rows(vector, k, exact, where, **search_params)
+        # Shortlist on the compact vectors, then order the shortlist by exact distance
+        rows, _ = self._candidate_rows(vector, max(k, refine), exact, where, **search_params)
+        distances = self.storage.exact_distances(vector, rows)
+        nearest = top_k(distances, k)
+        return rows[nearest], distances[nearest]
+
+    def _candidate_rows(self, vector, k, exact=False, where=None, **search_params):
+        mask = None
+        if where:
+            mask, matches = self._match(where)
+            if matches == 0:
+                return np.empty(0, dtype=np.int64), np.empty(0)
+            selectivity = matches / self.storage.live_count
+
+        if self._index_ready() and not exact:
+            self._catch_up()
+            if mask is None:
+                return self.index.search(vector, k, **search_params)
+            if selectivity > self.prefilter_threshold:
+                return self._post_filter(vector, k, mask, selectivity, **search_params)
+            # Few rows match: an exact scan of just those beats searching the index
+            return self._pre_filter(vector, k, mask)
+
+        # Scanning a gathered subset only pays off while it is much smaller than the whole matrix
+        if mask is not None and selectivity <= 0.5:
+            return self._pre_filter(vector, k, mask)
 
         # Calculate distances from the query vector to all vectors in the database
-        distances = distance.cdist([vector], self.vectors, 'euclidean')[0]
-        
+        distances = self.storage.distances(vector)
+        valid = self.storage.alive if mask is None else mask
+        if mask is not None or self.storage.live_count < len(self.storage):
+            distances[~valid] = np.inf
+
         # Get the indices of the k nearest neighbors
-        nearest_indices = np.argsort(distances)[:k]
-        nearest_vectors = [self.vectors[i] for i in nearest_indices]
+        nearest_indices = top_k(distances, min(k, int(np.count_nonzero(valid))))
+        return nearest_indices, distances[nearest_indices]
+
+    def _pre_filter(self, vector, k, mask):
+        """Exact distances computed only for the rows in the mask."""
+        rows = np.flatnonzero(mask)
+        distances = self.storage.distances(vector, rows)
+        nearest = top_k(distances, k)
+        return rows[nearest], distances[nearest]
+
+    def _post_filter(self, vector, k, mask, selectivity, **search_params):
+        """Over-fetch from the index and drop non-matching rows, widening until k survive."""
+        fetch = int(np.ceil(2 * k / selectivity))
+        while True:
+            rows, distances = self.index.search(vector, fetch, **search_params)
+            keep = mask[rows]
+            if np.count_nonzero(keep) >= k or len(rows) < fetch or fetch >= self.storage.live_count:
+                return rows[keep][:k], distances[keep][:k]
+            fetch *= 2
+
+    def query(self, vector, k=1, exact=False, where=None, **search_params):
+        """Query the database for the k nearest neighbors to the input vector.
+
+        where={"field": value, ...} only considers vectors whose metadata dict
+        has every field equal to the value (or to any member of a list of values).
+        """
+        nearest_indices, distances = self._search_rows(vector, k, exact, where, **search_params)
+        nearest_vectors = list(self.storage.get(nearest_indices))
         nearest_metadata = [self.metadata[i] for i in nearest_indices]
 
-        return nearest_vectors, nearest_metadata, distances[nearest_indices]
+        return nearest_vectors, nearest_metadata, self._reported(distances)
+
+    def _reported(self, distances):
+        """Euclidean distance for l2 (kernels work with its square); other metrics as computed."""
+        return np.sqrt(distances) if self.metric == "l2" else distances
 
-    def remove_vector(self, index):
-        """Remove a vector from the database by index."""
-        if 0 <= index < len(self.vectors):
-            del self.vectors[index]
-            del self.metadata[index]
+    def query_radius(self, vector, r, exact=False, where=None):
+        """Every vector within distance r of the query, nearest first.
+
+        r is in the units query() reports (euclidean distance for l2). A tree
+        index answers from the cells that reach the ball; otherwise all rows
+        are scanned. Returns (ids, distances, metadata).
+        """
+        if self.storage.live_count == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0), []
+        vector = self.storage.prepare(vector).ravel()
+        limit = r * r if self.metric == "l2" else r
+        mask = self._match(where)[0] if where else None
+        if self._index_ready() and hasattr(self.index, "radius") and not exact:
+            self._catch_up()
+            rows, distances = self.index.radius(vector, limit)
+            if mask is not None:
+                keep = mask[rows]
+                rows, distances = rows[keep], distances[keep]
         else:
-            raise IndexError("Index out of range.")
+            distances = self.storage.distances(vector)
+            valid = self.storage.alive if mask is None else mask
+            rows = np.flatnonzero(valid & (distances <= limit))
+            order = np.argsort(distances[rows])
+            rows, distances = rows[order], distances[rows[order]]
+        return self.storage.ids[rows], self._reported(distances), [self.metadata[i] for i in rows]
+
+    def query_batch(
+        self, queries, k=1, exact=False, where=None, refine=0, max_chunk_bytes=64 * 2**20, **search_params
+    ):
+        """Query the database with every row of a 2-D matrix at once.
+
+        Returns (ids, distances, metadata): (n_queries, k) arrays of ids and
+        distances, and one list of metadata per query. Brute-force batches are
+        split into chunks whose distance matrix stays under max_chunk_bytes.
+        Missing neighbors (fewer than k results) are padded with -1 and inf.
+        """
+        queries = np.atleast_2d(np.asarray(queries))
+        valid = self.storage.alive
+        if where:
+            valid, _ = self._match(where)
+        k = min(k, int(np.count_nonzero(valid)))
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        distances = np.full((len(queries), k), np.inf)
+
+        if (self._index_ready() and not exact) or refine:
+            for i, vector in enumerate(queries):
+                rows, d = self._search_rows(vector, k, exact, where, refine, **search_params)
+                indices[i, :len(rows)], distances[i, :len(rows)] = rows, d
+        elif k > 0:
+            row_bytes = len(self.storage) * self.storage.compute_dtype.itemsize
+            chunk = max(1, max_chunk_bytes // row_bytes)
+            for start in range(0, len(queries), chunk):
+                d = self.storage.distances_batch(self.storage.prepare(queries[start:start + chunk]))
+                if where or self.storage.live_count < len(self.storage):
+                    d[:, ~valid] = np.inf
+                nearest = top_k(d, k)
+                indices[start:start + chunk] = nearest
+                distances[start:start + chunk] = np.take_along_axis(d, nearest, axis=1)
+
+        metadata = [[self.metadata[i] for i in row if i >= 0] for row in indices]
+        ids = np.where(indices >= 0, self.storage.ids[indices], -1)
+        return ids, self._reported(distances), metadata
+
+    def remove_vector(self, vector_id):
+        """Remove a vector from the database by id.
+
+        The row is only tombstoned, so this is O(1) apart from the id lookup and
+        no other id changes. Storage is compacted once the share of tombstoned
+        rows passes compact_threshold.
+        """
+        row = self.storage.row_of(vector_id)
+        self.storage.delete(row)
+        self.metadata[row] = None
+        self._dirty.add(row // SEGMENT_ROWS)
+        if self.cache is not None:
+            self.cache.removed(row)
+        if self.wal is not None:
+            self.wal.log_remove(vector_id)
+        dead = len(self.storage) - self.storage.live_count
+        if self.compact_threshold is not None and dead > self.compact_threshold * len(self.storage):
+            self.compact()
+        if self.wal is not None:
+            self._logged()
+
+    def _logged(self):
+        if self.snapshot_every and self.wal.records >= self.snapshot_every:
+            self.save()
+
+    def compact(self):
+        """Rewrite the storage without tombstoned rows; ids are unchanged.
+
+        Memory-mapped vectors are copied to new files, so the last snapshot
+        stays readable; with a write-ahead log the new layout is saved right
+        away.
+        """
+        keep = self.storage.compact()
+        if self.cache is not None:
+            self.cache.clear()  # Cached answers hold row numbers, which just moved
+        self.metadata = [meta for meta, kept in zip(self.metadata, keep) if kept]
+        self.filters.compact(keep)
+        self._dirty = set(range(self._segments()))
+        if self._index_ready():
+            # Each index renumbers its rows in place; nothing is re-inserted
+            self.index.compact(keep)
+            self._index_dirty = True
+        if self.wal is not None:
+            self.save()
+
+    def _segments(self):
+        return -(-len(self.metadata) // SEGMENT_ROWS)
+
+    def save(self, path=None):
+        """Save the database to a directory.
+
+        Vectors and their norms go to memory-mappable .npy files, metadata to
+        pickled segments of SEGMENT_ROWS rows, the index to its own pickle and
+        the settings to a small sidecar written last. Segments, the index and
+        rewritten vector files are written under new names and only count
+        once the sidecar names them, so a crash mid-save leaves the previous
+        snapshot intact. Saving
+        again to the same directory is an incremental snapshot: only the rows,
+        tombstones and metadata segments changed since the last save are
+        written, and the index only when it was rebuilt or lags too far behind.
+        A database opened with mode='r+' can call save() without a path; this
+        also empties its write-ahead log.
+        """
+        path = path or self._snapshot_path or self.storage.path
+        if path is None:
+            raise ValueError("No path given and the database is not backed by files.")
+        incremental = path == self._snapshot_path
+        self.storage.save(path)
+        generation = self._generation + 1
+        written = []
+
+        segments = self._segments()
+        segment_files = self._segment_files[:segments] if incremental else []
+        for segment in range(segments):
+            if segment >= len(segment_files) or segment in self._dirty:
+                rows = slice(segment * SEGMENT_ROWS, (segment + 1) * SEGMENT_ROWS)
+                name = SEGMENT_FILE.format(segment, generation)
+                _dump(self.metadata[rows], os.path.join(path, name))
+                written.append(name)
+                segment_files[segment:segment + 1] = [name]
+        index_file, indexed_rows = self._index_file, self._indexed_rows
+        lag = len(self.storage) - indexed_rows
+        if not incremental or self._index_dirty or lag > INDEX_LAG * len(self.storage):
+            if self._index_ready():
+                self._catch_up()
+            index_file = INDEX_FILE.format(generation)
+            _dump(self.index, os.path.join(path, index_file))
+            written.append(index_file)
+            indexed_rows = len(self.storage) if self._index_ready() else 0
+
+        state = {
+            "storage": self.storage.header(),
+            "next_id": self.next_id,
+            "compact_threshold": self.compact_threshold,
+            "prefilter_threshold": self.prefilter_threshold,
+            "index_name": self.index_name,
+            "generation": generation,
+            "segment_files": segment_files,
+            "index_file": index_file,
+            "indexed_rows": indexed_rows,
+        }
+        try:
+            _dump(state, os.path.join(path, SIDECAR_FILE))
+        except BaseException:
+            # The files of this save are not part of any snapshot
+            for name in written:
+                _remove(os.path.join(path, name))
+            raise
+        # Files of earlier saves and compactions that the new sidecar no longer names
+        current = set(segment_files) | {index_file} | set(state["storage"]["files"].values())
+        for name in os.listdir(path):
+            stale = name.startswith("segment-") or name.startswith("index.") or is_column_file(name)
+            if stale and name not in current:
+                _remove(os.path.join(path, name))
+        self._snapshot_path = path
+        self._generation = generation
+        self._segment_files = segment_files
+        self._index_file, self._indexed_rows = index_file, indexed_rows
+        if index_file in written:
+            self._index_dirty = False
+        self._dirty = set()
+        if self.wal is not None and self.wal.path == os.path.join(path, WAL_FILE):
+            self.wal.truncate()
+
+    @classmethod
+    def open(cls, path, mode="r", snapshot_every=None, fsync=False):
+        """Open a saved database without copying its vectors.
+
+        The vectors stay memory-mapped, so several processes opening the same
+        directory share one copy through the page cache. mode='r' is read-only
+        and sees the last snapshot. mode='r+' writes changes back to the files
+        and recovers from a crash: the write-ahead log of the operations since
+        the last snapshot is replayed, then every add_vector and remove_vector
+        is logged before it returns (fsync=True also forces each record to
+        disk). With snapshot_every=n, save() runs after every n logged operations.
+        """
+        with open(os.path.join(path, SIDECAR_FILE), "rb") as f:
+            state = pickle.load(f)
+        db = cls()
+        db.storage = VectorStorage.open(path, mode, state["storage"])
+        db.metadata = []
+        for name in state["segment_files"]:
+            with open(os.path.join(path, name), "rb") as f:
+                db.metadata.extend(pickle.load(f))
+        for row, meta in enumerate(db.metadata):
+            db.filters.add(row, meta)
+        db.prefilter_threshold = state["prefilter_threshold"]
+        db.next_id = state["next_id"]
+        db.compact_threshold = state["compact_threshold"]
+        db.index_name = state["index_name"]
+        with open(os.path.join(path, state["index_file"]), "rb") as f:
+            db.index = pickle.load(f)
+        db._snapshot_path = path
+        db._generation = state["generation"]
+        db._segment_files = state["segment_files"]
+        db._index_file = state["index_file"]
+        db._indexed_rows = state["indexed_rows"]
+        db._index_dirty = False
+        if db.index is not None:
+            db.index.storage = db.storage
+            if db._index_ready() and db._indexed_rows < len(db.storage):
+                # Rows added after the index was last pickled
+                rows = np.arange(db._indexed_rows, len(db.storage))
+                db.index.add(rows, db.storage.get(rows))
+        if mode == "r+":
+            db._recover(os.path.join(path, WAL_FILE), fsync)
+            db.snapshot_every = snapshot_every
+        return db
+
+    def _recover(self, wal_path, fsync):
+        """Replay the write-ahead log, then checkpoint so the log starts empty."""
+        wal = WriteAheadLog(wal_path, fsync=fsync)
+        replayed = False
+        for record in wal.replay():
+            replayed = True
+            # Operations that reached the snapshot before a crash are skipped
+            if record[0] == "add" and record[1] >= self.next_id:
+                _, vector_id, vector, meta = record
+                self.add_vector(vector, meta=meta, vector_id=vector_id)
+            elif record[0] == "add_many":
+                _, ids, vectors, metadata = record
+                new = ids >= self.next_id
+                self.add_vectors(vectors[new], [meta for meta, kept in zip(metadata, new) if kept], ids[new])
+            elif record[0] == "remove":
+                try:
+                    self.remove_vector(record[1])
+                except IndexError:
+                    pass
+        self.wal = wal
+        if replayed:
+            self.save()
+
+    def close(self):
+        """Stop logging and release the write-ahead log; call save() first to checkpoint."""
+        if self.wal is not None:
+            self.wal.close()
+            self.wal = None
 
     def __len__(self):
         """Return the number of vectors in the database."""
-        return len(self.vectors)
+        return self.storage.live_count
+
+def _read_chunks(path, chunk_rows, key=None, delimiter=",", skiprows=0):
+    """Yield consecutive row blocks of at most chunk_rows rows from a .npy, .npz or CSV file."""
+    if path.endswith(".npy"):
+        array = np.load(path, mmap_mode="r")
+        for start in range(0, len(array), chunk_rows):
+            yield array[start:start + chunk_rows]
+    elif path.endswith(".npz"):
+        with zipfile.ZipFile(path) as archive:
+            name = (key + ".npy") if key else archive.namelist()[0]
+            with archive.open(name) as f:
+                if np.lib.format.read_magic(f) == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+                if fortran_order:
+                    raise ValueError("Fortran-ordered arrays cannot be streamed by rows.")
+                row_bytes = int(np.prod(shape[1:], dtype=np.int64)) * dtype.itemsize
+                for start in range(0, shape[0], chunk_rows):
+                    count = min(chunk_rows, shape[0] - start)
+                    yield np.frombuffer(f.read(count * row_bytes), dtype=dtype).reshape((count,) + shape[1:])
+    else:
+        with open(path) as f:
+            lines = itertools.islice(f, skiprows, None)
+            while True:
+                block = list(itertools.islice(lines, chunk_rows))
+                if not block:
+                    break
+                yield np.loadtxt(block, delimiter=delimiter, ndmin=2)
+
+def _dump(obj, file):
+    """Pickle to a temporary file and rename it over the old one, so readers never see half a file."""
+    with open(file + ".tmp", "wb") as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(file + ".tmp", file)
+
+def _remove(file):
+    try:
+        os.remove(file)
+    except FileNotFoundError:
+        pass
+
+def recall_at_k(db, queries, k=10, **search_params):
+    """Fraction of the exact k nearest neighbors that the index returns, averaged over queries."""
+    hits = total = 0
+    for vector in queries:
+        truth, _ = db.search(vector, k, exact=True)
+        found, _ = db.search(vector, k, **search_params)
+        hits += len(np.intersect1d(truth, found))
+        total += len(truth)
+    return hits / total if total else 1.0
 
 # Example usage
 if __name__ == "__main__":
@@ -56,3 +663,158 @@ if __name__ == "__main__":
     print("Nearest Vectors:", nearest_vectors)
     print("Metadata:", metadata)
     print("Distances:", distances)
+
+    # Querying several vectors in one call
+    ids, distances, metadata = db.query_batch([[5.0, 5.0, 5.0], [0.0, 0.0, 0.0]], k=2)
+    print("Batch Ids:", ids.tolist())
+    print("Batch Metadata:", metadata)
+
+    # Removing by id leaves the other ids unchanged
+    db.remove_vector(1)
+    print("After removing id 1:", db.query_batch([query_vector], k=2)[0].tolist())
+
+    # Filtering on metadata fields
+    catalog = VectorDatabase()
+    rng = np.random.default_rng(0)
+    for i, vector in enumerate(rng.normal(size=(1000, 8))):
+        catalog.add_vector(vector, meta={"item": i, "tenant": i % 10, "category": "shoes" if i % 3 else "hats"})
+    _, metadata, _ = catalog.query(rng.normal(size=8), k=3, where={"tenant": 4, "category": "hats"})
+    print("Filtered Metadata:", metadata)
+
+    # Cosine similarity: vectors are normalized once on insert
+    cosine_db = VectorDatabase(metric="cosine")
+    cosine_db.add_vector([1.0, 0.0], meta="east")
+    cosine_db.add_vector([0.0, 3.0], meta="north")
+    cosine_db.add_vector([-2.0, 0.0], meta="west")
+    _, metadata, distances = cosine_db.query([5.0, 1.0], k=2)
+    print("Cosine Metadata:", metadata, "Distances:", distances)
+
+    # Low-dimensional points get an exact k-d tree, which also answers radius queries
+    points = VectorDatabase()
+    points.add_vectors(rng.uniform(-180, 180, size=(200000, 2)), metadata=[{"site": i} for i in range(200000)])
+    ids, distances, metadata = points.query_radius([2.35, 48.85], r=0.5)
+    print(f"{points.index_name} index, {len(ids)} points within 0.5 of the query, nearest:", metadata[:1], distances[:1])
+
+    # Result cache: repeated queries are answered from memory until a write could change them
+    cached_db = VectorDatabase(cache_size=256, cache_ttl=60)
+    cached_db.add_vectors(rng.normal(size=(50000, 32)))
+    hot = rng.normal(size=(20, 32))
+    for vector in hot[rng.integers(len(hot), size=1000)]:
+        cached_db.search(vector, k=10)
+    cached_db.add_vector(hot[0] + 0.01)  # Lands in the answer of hot[0] only, so only that entry is dropped
+    print("Cache:", cached_db.cache.stats())
+
+    # Saving to disk and reopening memory-mapped
+    import tempfile
+    with tempfile.TemporaryDirectory() as path:
+        db.save(path)
+        reopened = VectorDatabase.open(path, mode="r")
+        print("Reopened Metadata:", reopened.query(query_vector, k=2)[1])
+
+        # Durable ingestion: every write is logged, snapshots only write what changed
+        durable = VectorDatabase.open(path, mode="r+", snapshot_every=10000)
+        start = time.perf_counter()
+        for i, vector in enumerate(rng.normal(size=(50000, 3))):
+            durable.add_vector(vector, meta=f"Logged {i}")
+        print(f"Logged inserts: {50000 / (time.perf_counter() - start):.0f}/s")
+        durable.add_vector([5.0, 5.0, 5.1], meta="Not in any snapshot")
+        durable.close()  # Stands in for a crash: the last add is only in the log
+        recovered = VectorDatabase.open(path, mode="r+")
+        print("Recovered:", len(recovered), recovered.query([5.0, 5.0, 5.1], k=1)[1])
+        recovered.close()
+
+        # Bulk ingestion: files are streamed in chunks straight into the storage buffer
+        np.save(os.path.join(path, "embeddings.npy"), rng.normal(size=(500000, 64)).astype(np.float32))
+        bulk_db = VectorDatabase(dtype=np.float32)
+        stats = bulk_db.ingest(os.path.join(path, "embeddings.npy"), chunk_rows=100000)
+        print(f"Ingested {stats['rows']} rows from .npy: {stats['rows_per_second']:.0f} rows/s")
+
+    # Approximate search with an inverted-file index
+    ivf_db = VectorDatabase(index="ivf", nlist=32, nprobe=4, seed=0)
+    for i, vector in enumerate(rng.normal(size=(5000, 16))):
+        ivf_db.add_vector(vector, meta=i)
+    ivf_db.train()
+    ivf_db.add_vector(rng.normal(size=16), meta="added after training")
+
+    query_vector = rng.normal(size=16)
+    _, metadata, distances = ivf_db.query(query_vector, k=5, nprobe=8)
+    print("IVF Metadata:", metadata)
+    print("IVF Distances:", distances)
+
+    # Graph search with HNSW, checked against brute force as ground truth
+    hnsw_db = VectorDatabase(index="hnsw", M=12, ef_construction=100, ef_search=50, seed=0)
+    for i, vector in enumerate(rng.normal(size=(2000, 16))):
+        hnsw_db.add_vector(vector, meta=i)
+    for vector_id in range(0, 2000, 10):
+        hnsw_db.remove_vector(vector_id)
+
+    queries = rng.normal(size=(50, 16))
+    print("HNSW recall@10:", recall_at_k(hnsw_db, queries, k=10))
+    print("HNSW recall@10 (ef_search=200):", recall_at_k(hnsw_db, queries, k=10, ef_search=200))
+
+    # Product quantization: memory per vector against recall, with and without re-ranking.
+    # Kept in RAM, the full vectors cost more than the codes save; with path=... they live in
+    # memory-mapped files, only the codes stay resident and re-ranking reads the rows it needs.
+    data = rng.normal(size=(5000, 32))
+    print(f"Flat float64 storage: {VectorDatabase(dim=32).storage.bytes_per_vector()} bytes/vector")
+    for m in (4, 8, 16):
+        queries = rng.normal(size=(50, 32))
+        with tempfile.TemporaryDirectory() as path:
+            pq_db = VectorDatabase(index="pq", m=m, seed=0, path=path)
+            for i, vector in enumerate(data):
+                pq_db.add_vector(vector, meta=i)
+            pq_db.train()
+            print(
+                f"PQ m={m}: {pq_db.index.memory_per_vector()} bytes/vector in RAM "
+                f"({pq_db.index.code_bytes() + pq_db.storage.bytes_per_vector()} with the vectors in RAM); "
+                f"recall@10 {recall_at_k(pq_db, queries, k=10):.3f}, "
+                f"with re-ranking of 100 {recall_at_k(pq_db, queries, k=10, rerank=100):.3f}"
+            )
+            del pq_db
+
+    # Hashing: probing more buckets per table trades queries per second for recall
+    centers = rng.normal(size=(500, 32)) * 3
+    data = centers[rng.integers(0, 500, 100000)] + rng.normal(size=(100000, 32))
+    queries = centers[rng.integers(0, 500, 200)] + rng.normal(size=(200, 32))
+    for metric, bits in (("l2", 6), ("cosine", 16)):
+        lsh_db = VectorDatabase(index="lsh", metric=metric, tables=8, bits=bits, width=16.0, seed=0)
+        start = time.perf_counter()
+        for vector in data:
+            lsh_db.add_vector(vector)
+        print(f"LSH {metric}: {len(data) / (time.perf_counter() - start):.0f} adds/s")
+        for probes in (0, 4, 16):
+            start = time.perf_counter()
+            lsh_db.query_batch(queries, k=10, probes=probes)
+            qps = len(queries) / (time.perf_counter() - start)
+            recall = recall_at_k(lsh_db, queries, k=10, probes=probes)
+            print(f"LSH {metric} probes={probes}: {qps:.0f} QPS, recall@10 {recall:.3f}")
+        start = time.perf_counter()
+        for vector in queries:
+            lsh_db.search(vector, k=10, exact=True)
+        print(f"Brute force {metric}: {len(queries) / (time.perf_counter() - start):.0f} QPS")
+
+    # Storage precision: memory per vector against recall@10, measured against float64 ground truth
+    data = rng.normal(size=(20000, 64)) * rng.uniform(0.5, 2.0, size=64)
+    queries = rng.normal(size=(100, 64))
+    exact_db = VectorDatabase(dim=64)
+    for vector in data:
+        exact_db.add_vector(vector)
+    truth, _, _ = exact_db.query_batch(queries, k=10)
+
+    def overlap(found):
+        return np.mean([len(np.intersect1d(t, f)) for t, f in zip(truth, found)]) / 10
+
+    # int8 with keep_originals holds a float32 copy too, more than float32 alone; it only pays
+    # off when that copy stays on disk, memory-mapped by open(), and only re-ranked rows are read
+    for dtype, keep_originals in ((np.float64, False), (np.float32, False), (np.float16, False),
+                                  (np.int8, False), (np.int8, True)):
+        compact_db = VectorDatabase(dim=64, dtype=dtype, keep_originals=keep_originals)
+        for vector in data:
+            compact_db.add_vector(vector)
+        ids, _, _ = compact_db.query_batch(queries, k=10)
+        name = np.dtype(dtype).name + (" + originals" if keep_originals else "")
+        line = f"{name}: {compact_db.storage.bytes_per_vector()} bytes/vector, recall@10 {overlap(ids):.3f}"
+        if keep_originals:
+            ids, _, _ = compact_db.query_batch(queries, k=10, refine=50)
+            line += f", re-ranking 50 {overlap(ids):.3f}"
+        print(line)
@@ -0,0 +1,87 @@
+import os
+import pickle
+import struct
+import zlib
+import numpy as np
+
+# Record: op, vector id, payload length, payload, crc32 of everything before it
+HEADER = struct.Struct("<Bqi")
+CRC = struct.Struct("<I")
+ADD, REMOVE, ADD_MANY = 1, 2, 3
+
+class WriteAheadLog:
+    """Append-only log of add and remove operations since the last snapshot.
+
+    Every record is written with one write call and carries a checksum, so a
+    crash can at worst leave a torn record at the end, which replay() drops.
+    Each record reaches the OS before the call returns (it survives a process
+    crash); fsync=True also forces it to disk (it survives a power loss).
+    """
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self.records = 0  # Rows added or removed since the last truncate()
+        self._file = open(path, "ab")
+
+    def log_add(self, vector_id, vector, meta=None):
+        vector = np.asarray(vector, dtype=np.float64).ravel()
+        payload = struct.pack("<i", len(vector)) + vector.tobytes() + pickle.dumps(meta, protocol=pickle.HIGHEST_PROTOCOL)
+        self._append(ADD, vector_id, payload)
+
+    def log_add_many(self, ids, vectors, metadata):
+        """One record for a whole matrix of rows, kept in its own dtype."""
+        payload = pickle.dumps((np.asarray(ids), np.ascontiguousarray(vectors), list(metadata)), protocol=pickle.HIGHEST_PROTOCOL)
+        self._append(ADD_MANY, int(ids[0]), payload, len(ids))
+
+    def log_remove(self, vector_id):
+        self._append(REMOVE, vector_id, b"")
+
+    def _append(self, op, vector_id, payload, rows=1):
+        record = HEADER.pack(op, vector_id, len(payload)) + payload
+        self._file.write(record + CRC.pack(zlib.crc32(record)))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.records += rows
+
+    def replay(self):
+        """Yield ("add", id, vector, meta), ("add_many", ids, vectors, metadata) and ("remove", id) records in order.
+
+        Stops at the first incomplete or corrupt record and cuts the log
+        there, so later appends follow the last good record.
+        """
+        good = 0
+        with open(self.path, "rb") as f:
+            data = f.read()
+        while good + HEADER.size <= len(data):
+            op, vector_id, length = HEADER.unpack_from(data, good)
+            end = good + HEADER.size + length
+            if length < 0 or end + CRC.size > len(data):
+                break
+            (crc,) = CRC.unpack_from(data, end)
+            if crc != zlib.crc32(data[good:end]):
+                break
+            payload = data[good + HEADER.size:end]
+            good = end + CRC.size
+            if op == ADD:
+                (dim,) = struct.unpack_from("<i", payload)
+                vector = np.frombuffer(payload, dtype=np.float64, count=dim, offset=4)
+                yield "add", vector_id, vector, pickle.loads(payload[4 + 8 * dim:])
+            elif op == ADD_MANY:
+                yield ("add_many",) + pickle.loads(payload)
+            else:
+                yield "remove", vector_id
+        if good < len(data):
+            self._file.truncate(good)
+
+    def truncate(self):
+        """Empty the log once a snapshot holds everything in it."""
+        self._file.truncate(0)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.records = 0
+
+    def close(self):
+        self._file.close()